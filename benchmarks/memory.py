@@ -0,0 +1,62 @@
+"""Measure the memory used by each queued request, with tracemalloc.
+
+Metadata requests are made for N identifiers, as ItemMiner does, and
+kept in a list as they would be in a queue. Prints one JSON line with
+the number of bytes allocated per request, and the lines of code that
+allocated the most.
+
+usage: memory.py [--requests N] [--field FIELD...] [--top N]
+
+options:
+  --requests N   The number of requests to make. [default: 100000]
+  --field FIELD  Project each item onto these fields, as with --field.
+  --top N        The number of top allocating lines to show. [default: 5]
+
+"""
+import os
+import sys
+import json
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docopt import docopt
+
+from iamine.core import ItemMiner, metadata_requests
+from iamine.projection import Projection
+
+
+def measure(n, fields=None, top=None):
+    top = 5 if not top else top
+    miner = ItemMiner()
+    projection = Projection(fields) if fields else None
+    # The identifiers are read before mining starts, so they aren't
+    # counted against the requests.
+    identifiers = ['item{:08d}'.format(i) for i in range(n)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    requests = list(metadata_requests(identifiers, {'dontcache': 1}, None, miner, projection))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'lineno')
+    total = sum(s.size_diff for s in stats)
+    miner.close()
+    return dict(
+        requests=len(requests),
+        bytes_per_request=round(total / float(len(requests)), 1),
+        total_mb=round(total / 1e6, 1),
+        top=['{}:{} {}B'.format(s.traceback[0].filename, s.traceback[0].lineno, s.size_diff)
+             for s in stats[:top]],
+    )
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv=argv)
+    result = measure(int(args['--requests']), args['--field'], int(args['--top']))
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Benchmark ItemMiner and SearchMiner end to end against a local
+stand-in Archive.org server (see server.py).
+
+Each scenario runs in a fresh process, so peak RSS is measured per
+scenario, and prints one JSON line with its throughput, latency and
+error counts.
+
+usage: run.py [--scenario NAME...] [--items N] [--workers N]
+              [--rows N] [--latency SECONDS]
+              [--payload-size BYTES] [--error-rate RATE]
+              [--port PORT]
+
+options:
+  --scenario NAME       The scenarios to run: items, search, mine-ids or scrape.
+                        All of them are run by default.
+  --items N             The number of items to mine. [default: 10000]
+  --workers N           The number of workers. [default: 100]
+  --rows N              The number of search results per page. [default: 500]
+  --latency SECONDS     The server's mean response latency. [default: 0.05]
+  --payload-size BYTES  The approximate size of each item's metadata. [default: 10000]
+  --error-rate RATE     The fraction of requests the server fails. [default: 0]
+  --port PORT           The port to run the server on. [default: 8765]
+
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docopt import docopt
+
+from iamine.core import ItemMiner, SearchMiner
+from iamine.sinks import StreamSink
+from server import StandInServer
+
+
+SCENARIOS = ('items', 'search', 'mine-ids', 'scrape')
+
+
+def bench_miner(cls, base_url):
+    """Make a subclass of a miner that talks to the stand-in server, and
+    keeps every request's latency.
+    """
+    class BenchMiner(cls):
+        check_auth_url = '{}/s3?check_auth=1'.format(base_url)
+        rate_limit_url = '{}/metadata/iamine-rate-limiter'.format(base_url)
+
+        def __init__(self, **kwargs):
+            self.latencies = []
+            super(BenchMiner, self).__init__(**kwargs)
+
+        def observe(self, request, status, latency, exc=None, size=None):
+            self.latencies.append(latency)
+            super(BenchMiner, self).observe(request, status, latency, exc, size)
+
+    return BenchMiner
+
+
+def _serve(port, kwargs):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    StandInServer(loop=loop, **kwargs).serve(port=port)
+
+
+def _wait_for_server(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(.1)
+
+
+def _run_scenario(scenario, port, items, workers, rows, results):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    host = '127.0.0.1:{}'.format(port)
+    base_url = 'http://{}'.format(host)
+    cls = ItemMiner if scenario == 'items' else SearchMiner
+    miner = bench_miner(cls, base_url)(
+            loop=loop,
+            max_tasks=workers,
+            sink=StreamSink(stream=open(os.devnull, 'wb'), loop=loop),
+            hosts=[host],
+            access='bench',
+            secret='bench',
+            config_file=os.devnull)
+
+    start = time.monotonic()
+    if scenario == 'items':
+        identifiers = (StandInServer.identifier(n) for n in range(items))
+        loop.run_until_complete(miner.mine_items(identifiers))
+    else:
+        loop.run_until_complete(miner.search('all:1',
+                                             params=dict(rows=rows),
+                                             mine_ids=(scenario == 'mine-ids'),
+                                             cursor=(scenario == 'scrape')))
+    elapsed = time.monotonic() - start
+    miner.close()
+    loop.close()
+
+    latencies = sorted(miner.latencies)
+    p99 = latencies[int(0.99 * (len(latencies) - 1))] if latencies else None
+    results.put(dict(
+        scenario=scenario,
+        items=items,
+        seconds=round(elapsed, 3),
+        items_per_second=round(items / elapsed, 1),
+        requests=len(latencies),
+        latency_p99=p99,
+        retries=miner.metrics.retries,
+        give_ups=miner.metrics.give_ups,
+        # ru_maxrss is in kilobytes on Linux.
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    ))
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv=argv)
+    scenarios = args['--scenario'] if args['--scenario'] else SCENARIOS
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            sys.exit(sys.stderr.write('error: unknown scenario "{}"\n'.format(scenario)))
+    port = int(args['--port'])
+    items = int(args['--items'])
+
+    server = multiprocessing.Process(target=_serve, args=(port, dict(
+            latency=float(args['--latency']),
+            payload_size=int(args['--payload-size']),
+            error_rate=float(args['--error-rate']),
+            items=items)))
+    server.daemon = True
+    server.start()
+    try:
+        _wait_for_server(port)
+        results = multiprocessing.Queue()
+        for scenario in scenarios:
+            p = multiprocessing.Process(
+                    target=_run_scenario,
+                    args=(scenario, port, items, int(args['--workers']),
+                          int(args['--rows']), results))
+            p.start()
+            # Results are small enough to fit in the queue's pipe, so the
+            # process can be joined before they are read.
+            p.join()
+            if p.exitcode != 0:
+                result = dict(scenario=scenario, error='exited with {}'.format(p.exitcode))
+            else:
+                result = results.get()
+            sys.stdout.write('{}\n'.format(json.dumps(result)))
+            sys.stdout.flush()
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""A local stand-in for the Archive.org endpoints ia-mine uses.
+
+usage: server.py [--port PORT] [--latency SECONDS]
+                 [--payload-size BYTES] [--error-rate RATE]
+                 [--items N] [--rate-limit N]
+
+options:
+  --port PORT           The port to listen on. [default: 8080]
+  --latency SECONDS     The mean response latency. Latencies are drawn from an
+                        exponential distribution. [default: 0.05]
+  --payload-size BYTES  The approximate size of each item's metadata. [default: 10000]
+  --error-rate RATE     The fraction of requests answered with a 503 (or 429).
+                        [default: 0]
+  --items N             The number of items in the index. [default: 10000]
+  --rate-limit N        The global rate limit served to clients. [default: 100000]
+
+"""
+import sys
+import json
+import random
+import asyncio
+
+from aiohttp import web
+
+
+class StandInServer(object):
+    """Serve check_auth, the rate limiter item, ``/metadata``,
+    ``/advancedsearch.php`` and the scrape API from memory.
+
+    :param latency: (optional) The mean response latency in seconds.
+    :type latency: float
+
+    :param payload_size: (optional) The approximate size of each item's
+                         metadata in bytes.
+    :type payload_size: int
+
+    :param error_rate: (optional) The fraction of metadata and search
+                       requests answered with a 503, or a 429 with a
+                       ``Retry-After`` header.
+    :type error_rate: float
+
+    :param items: (optional) The number of items in the index.
+    :type items: int
+
+    :param rate_limit: (optional) The global rate limit served to clients.
+    :type rate_limit: int
+    """
+
+    def __init__(self, latency=None, payload_size=None, error_rate=None, items=None,
+                 rate_limit=None, loop=None):
+        self.latency = 0.05 if latency is None else latency
+        self.payload_size = 10000 if payload_size is None else payload_size
+        self.error_rate = 0.0 if not error_rate else error_rate
+        self.items = 10000 if items is None else items
+        self.rate_limit = 100000 if not rate_limit else rate_limit
+        self.loop = asyncio.get_event_loop() if not loop else loop
+
+        # Every item's metadata is the same apart from its identifier, so
+        # it is rendered once, around a placeholder.
+        files = []
+        while len(json.dumps(files)) < self.payload_size:
+            n = len(files)
+            files.append(dict(name='file{:04d}.txt'.format(n), source='original',
+                              format='Text', size=str(n * 1000), md5='0' * 32))
+        doc = dict(metadata=dict(identifier='@ID@', mediatype='texts', title='@ID@'),
+                   files=files, server='localhost', dir='/0/items/@ID@')
+        self._template = json.dumps(doc).split('@ID@')
+
+        self.app = web.Application(loop=self.loop)
+        self.app.router.add_route('GET', '/s3', self.check_auth)
+        self.app.router.add_route('GET', '/metadata/iamine-rate-limiter', self.rate_limiter)
+        self.app.router.add_route('GET', '/metadata/{identifier}', self.metadata)
+        self.app.router.add_route('GET', '/advancedsearch.php', self.advancedsearch)
+        self.app.router.add_route('GET', '/services/search/v1/scrape', self.scrape)
+
+    @staticmethod
+    def identifier(n):
+        return 'item{:08d}'.format(n)
+
+    def _json(self, obj):
+        return web.Response(body=json.dumps(obj).encode('utf-8'),
+                            content_type='application/json')
+
+    @asyncio.coroutine
+    def _delay(self):
+        """Wait for a random latency, and return an error response if one
+        is injected.
+        """
+        if self.latency:
+            yield from asyncio.sleep(random.expovariate(1.0 / self.latency),
+                                     loop=self.loop)
+        if self.error_rate and (random.random() < self.error_rate):
+            if random.random() < 0.5:
+                return web.Response(status=429, headers={'Retry-After': '1'})
+            return web.Response(status=503)
+
+    @asyncio.coroutine
+    def check_auth(self, request):
+        return self._json(dict(authorized=True))
+
+    @asyncio.coroutine
+    def rate_limiter(self, request):
+        return self._json(dict(metadata=dict(rate_per_second=str(self.rate_limit))))
+
+    @asyncio.coroutine
+    def metadata(self, request):
+        error = yield from self._delay()
+        if error:
+            return error
+        body = request.match_info['identifier'].join(self._template)
+        return web.Response(body=body.encode('utf-8'), content_type='application/json')
+
+    @asyncio.coroutine
+    def advancedsearch(self, request):
+        error = yield from self._delay()
+        if error:
+            return error
+        rows = int(request.GET.get('rows', 50))
+        page = int(request.GET.get('page', 1))
+        start = (page - 1) * rows
+        docs = [dict(identifier=self.identifier(n))
+                for n in range(start, min(start + rows, self.items))]
+        return self._json(dict(responseHeader=dict(status=0, params=dict(request.GET)),
+                               response=dict(numFound=self.items, start=start, docs=docs)))
+
+    @asyncio.coroutine
+    def scrape(self, request):
+        error = yield from self._delay()
+        if error:
+            return error
+        count = int(request.GET.get('count', 5000))
+        start = int(request.GET.get('cursor', 0))
+        end = min(start + count, self.items)
+        j = dict(items=[dict(identifier=self.identifier(n)) for n in range(start, end)],
+                 count=(end - start), total=self.items)
+        if end < self.items:
+            j['cursor'] = str(end)
+        return self._json(j)
+
+    def serve(self, host='127.0.0.1', port=8080):
+        """Serve until interrupted."""
+        handler = self.app.make_handler()
+        server = self.loop.run_until_complete(self.loop.create_server(handler, host, port))
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.loop.run_until_complete(handler.finish_connections())
+
+
+def main(argv=None):
+    from docopt import docopt
+    args = docopt(__doc__, argv=argv)
+    server = StandInServer(latency=float(args['--latency']),
+                           payload_size=int(args['--payload-size']),
+                           error_rate=float(args['--error-rate']),
+                           items=int(args['--items']),
+                           rate_limit=int(args['--rate-limit']))
+    sys.stderr.write('Serving on 127.0.0.1:{}\n'.format(args['--port']))
+    server.serve(port=int(args['--port']))
+
+
+if __name__ == '__main__':
+    main()
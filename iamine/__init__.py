@@ -16,7 +16,8 @@ __license__ = 'AGPL 3'
 __copyright__ = 'Copyright 2015 Internet Archive'
 
 
-from .api import mine_items, search, mine_urls, configure
+from .api import mine_items, search, mine_urls, configure, iter_items, iter_search
 
 
-__all__ = ['mine_items', 'search', 'mine_urls', '__version__', 'configure']
+__all__ = ['mine_items', 'search', 'mine_urls', '__version__', 'configure', 'iter_items',
+           'iter_search']
@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 """Concurrently retrieve metadata from Archive.org items.
 
-usage: ia-mine [--config-file=<FILE>] (<itemlist> | -) [--debug] [--workers WORKERS]
-               [--retries RETRIES] [--secure] [--hosts HOSTS]
+usage: ia-mine [--config-file=<FILE>] (<itemlist> | -) [--field FIELD...]
+               [--debug] [--workers WORKERS]
+               [--adaptive [--min-workers WORKERS]] [--processes PROCESSES] [--retries RETRIES] [--secure]
+               [--hosts HOSTS] [--connections CONNECTIONS]
+               [--host-connections CONNECTIONS] [--journal FILE]
+               [--dedupe] [--dedupe-fpr RATE]
+               [--cache-dir DIR [--cache-size MB] [--cache-ttl SECONDS]]
+               [--output FILE [--max-file-size MB] [--max-file-records N]
+                [--shards SHARDS] [--column FIELD...]]
+               [--stats-interval SECONDS] [--metrics-file FILE]
        ia-mine [--all | --search QUERY] [[--info | --info --field FIELD...]
                |--num-found | --mine-ids | --field FIELD... | --itemlist]
-               [--debug] [--rows ROWS] [--workers WORKERS]
-               [--retries RETRIES] [--secure] [--hosts HOSTS]
+               [--debug] [--rows ROWS] [--cursor] [--partitions N]
+               [--watermark FILE [--watermark-field FIELD]]
+               [--workers WORKERS] [--adaptive [--min-workers WORKERS]]
+               [--retries RETRIES] [--secure]
+               [--hosts HOSTS] [--connections CONNECTIONS]
+               [--host-connections CONNECTIONS] [--journal FILE]
+               [--dedupe] [--dedupe-fpr RATE]
+               [--cache-dir DIR [--cache-size MB] [--cache-ttl SECONDS]]
+               [--output FILE [--max-file-size MB] [--max-file-records N]
+                [--shards SHARDS] [--column FIELD...]]
+               [--stats-interval SECONDS] [--metrics-file FILE]
        ia-mine [--config-file=<FILE>] [-h | --version | --configure]
 
 positional arguments:
@@ -27,7 +44,9 @@ optional arguments:
   -m, --mine-ids             Mine items returned from search results.
                              [default: False]
   -i, --info                 Print search result response header to stdout and exit.
-  -f, --field FIELD          Fields to include in search results.
+  -f, --field FIELD          Fields to include in search results. When mining items,
+                             the fields of each item to output, as dotted paths,
+                             e.g. metadata.title or files[].name.
   -i, --itemlist             Print identifiers only to stdout. [default: False]
   -n, --num-found            Print the number of items found for the given search
                              query.
@@ -35,14 +54,70 @@ optional arguments:
                              the Archive.org Advancedsearch API. On slower networks,
                              it may be useful to use a lower value, and on faster
                              networks, a higher value. [default: 50]
+  --cursor                   Page through search results with the scrape API's
+                             cursor. Each search result is output on its own line,
+                             and --rows is raised to at least 100.
+  --partitions N             Split the query into N disjoint sub-queries and page
+                             through them concurrently with cursors. Using this
+                             option implies --cursor.
+  --watermark FILE           Only mine items changed since the last run, by keeping
+                             the latest date seen in FILE. The date is only saved
+                             if no requests failed. This option implies --cursor.
+  --watermark-field FIELD    The date field to keep in the watermark file.
+                             [default: oai_updatedate]
   -w, --workers WORKERS
                              The maximum number of tasks to run at once.
                              [default: 100]
+  --adaptive                 Adjust the number of tasks running at once to the
+                             observed latency and error rate, between the values
+                             of --min-workers and --workers.
+  --min-workers WORKERS      With --adaptive, the minimum number of tasks to run at
+                             once. [default: 4]
+  -p, --processes PROCESSES  Mine the itemlist with PROCESSES processes. The itemlist
+                             must be a file. Output to stdout is merged, and --output
+                             files are written one per process.
   -r, --retries RETRIES
                              The maximum number of retries for each item.
                              [default: 10]
   --secure                   Use HTTPS. HTTP is used by default.
-  -H, --hosts HOSTS          A file containing a list of hosts to shuffle through.
+  -H, --hosts HOSTS          A file containing a list of hosts to balance requests
+                             over. Failing hosts are skipped until they recover.
+  --connections CONNECTIONS  The maximum number of open connections. Defaults to
+                             the number of workers.
+  --host-connections CONNECTIONS
+                             The maximum number of open connections to each host.
+                             Unlimited by default.
+  -j, --journal FILE         Record completed work in FILE, and skip work already
+                             recorded there. Use this to resume interrupted runs.
+  --dedupe                   Skip identifiers that have already been mined in this
+                             run. With --processes, duplicates are only skipped
+                             within each process's part of the itemlist.
+  --dedupe-fpr RATE          Skip duplicates using a Bloom filter that mistakes a
+                             new identifier for a duplicate at most RATE of the
+                             time, e.g. 0.001. This is not exact, but uses less
+                             memory and disk than plain deduplication.
+  --cache-dir DIR            Cache item metadata locally in DIR. Cached items are
+                             revalidated with the server before being reused.
+  --cache-size MB            The maximum size of the local cache in megabytes.
+                             [default: 1024]
+  --cache-ttl SECONDS        Reuse cached items younger than SECONDS without
+                             revalidating them. [default: 0]
+  -o, --output FILE          Write JSONL output to FILE rather than stdout. Output is
+                             compressed if FILE ends with ".gz" or ".zst". If FILE
+                             ends with ".sqlite" or ".db", records are upserted by
+                             identifier into its "items" table instead.
+  --max-file-size MB         Start a new output file after writing MB megabytes.
+  --max-file-records N       Start a new output file after writing N records.
+  --shards SHARDS            Write output to the directory FILE, split into SHARDS
+                             files by identifier, and index each record so it can
+                             be looked up without a scan. See iamine.shards.
+  --column FIELD             With SQLite output, also store FIELD of each record,
+                             as a dotted path like metadata.title, in an indexed
+                             column of its own.
+  --stats-interval SECONDS   Write throughput, latency, retry and queue statistics
+                             to stderr as a JSON line every SECONDS seconds.
+  --metrics-file FILE        Write metrics to FILE in the Prometheus text format,
+                             for the node exporter's textfile collector.
 
 """
 from .utils import suppress_interrupt_messages, suppress_brokenpipe_messages, handle_cli_exceptions
@@ -54,11 +129,14 @@ import logging
 import os
 import sys
 import json
+from collections import OrderedDict
 
 from docopt import docopt, DocoptExit
 from schema import Schema, Use, Or, SchemaError
 
 from .api import mine_items, search, configure
+from .sinks import FileSink, ShardedSink, SQLiteSink
+from .watermark import Watermark
 from . import __version__
 from .exceptions import AuthenticationError
 
@@ -69,7 +147,10 @@ asyncio_logger.setLevel(logging.CRITICAL)
 
 def print_itemlist(resp):
     j = yield from resp.json(encoding='utf-8')
-    for doc in j.get('response', {}).get('docs', []):
+    # Advancedsearch pages have docs under "response", scrape API pages
+    # have them under "items".
+    docs = j.get('response', {}).get('docs', []) if 'response' in j else j.get('items', [])
+    for doc in docs:
         print(doc.get('identifier'))
 
 
@@ -91,7 +172,28 @@ def main(argv=None, session=None):
     schema = Schema({object: bool,
         '--search': Or(None, Use(str)),
         '--field': list,
+        '--column': list,
         '--config-file': Or(None, str),
+        '--journal': Or(None, str),
+        '--dedupe-fpr': Or(None, Use(float,
+            error='"{}" should be a number.'.format(args['--dedupe-fpr']))),
+        '--watermark': Or(None, str),
+        '--watermark-field': Or(None, str),
+        '--cache-dir': Or(None, str),
+        '--cache-size': Use(lambda x: int(x) * 1024 * 1024,
+            error='"{}" should be an integer.'.format(args['--cache-size'])),
+        '--cache-ttl': Use(int,
+            error='"{}" should be an integer.'.format(args['--cache-ttl'])),
+        '--output': Or(None, str),
+        '--max-file-size': Or(None, Use(lambda x: int(x) * 1024 * 1024,
+            error='"{}" should be an integer.'.format(args['--max-file-size']))),
+        '--max-file-records': Or(None, Use(int,
+            error='"{}" should be an integer.'.format(args['--max-file-records']))),
+        '--shards': Or(None, Use(int,
+            error='"{}" should be an integer.'.format(args['--shards']))),
+        '--stats-interval': Or(None, Use(float,
+            error='"{}" should be a number.'.format(args['--stats-interval']))),
+        '--metrics-file': Or(None, str),
         '--rows': Use(int,
             error='"{}" should be an integer'.format(args['--rows'])),
         '--hosts': Or(None, Use(parse_hosts,
@@ -99,8 +201,18 @@ def main(argv=None, session=None):
         '--retries': Use(int, '"{}" should be an integer.'.format(args['--retries'])),
         '<itemlist>': Use(open_file_or_stdin,
             error='"{}" should be readable'.format(args['<itemlist>'])),
+        '--processes': Or(None, Use(int,
+            error='"{}" should be an integer.'.format(args['--processes']))),
+        '--partitions': Or(None, Use(int,
+            error='"{}" should be an integer.'.format(args['--partitions']))),
         '--workers': Use(int,
             error='"{}" should be an integer.'.format(args['--workers'])),
+        '--min-workers': Use(int,
+            error='"{}" should be an integer.'.format(args['--min-workers'])),
+        '--connections': Or(None, Use(int,
+            error='"{}" should be an integer.'.format(args['--connections']))),
+        '--host-connections': Or(None, Use(int,
+            error='"{}" should be an integer.'.format(args['--host-connections']))),
     })
     try:
         args = schema.validate(args)
@@ -119,6 +231,23 @@ def main(argv=None, session=None):
             sys.exit(1)
         sys.exit(0)
 
+    # Output.
+    sink = None
+    if args['--shards']:
+        if args['--max-file-size'] or args['--max-file-records']:
+            sys.exit(sys.stderr.write(
+                'error: --shards can not be used with --max-file-size or '
+                '--max-file-records\n'))
+        sink = ShardedSink(args['--output'], shards=args['--shards'])
+    elif args['--output'] and args['--output'].endswith(('.sqlite', '.db')):
+        # As with --field, drop the duplicates docopt adds.
+        sink = SQLiteSink(args['--output'],
+                          columns=list(OrderedDict.fromkeys(args['--column'])))
+    elif args['--output']:
+        sink = FileSink(args['--output'],
+                        max_bytes=args['--max-file-size'],
+                        max_records=args['--max-file-records'])
+
     # Search.
     if args['--search'] or args['--all']:
         query = 'all:1' if not args['--search'] else args['--search']
@@ -129,12 +258,31 @@ def main(argv=None, session=None):
         }
         for i, f in enumerate(args['--field']):
             params['fl[{}]'.format(i)] = f
+        watermark = None
+        if args['--watermark']:
+            watermark = Watermark(args['--watermark'], args['--watermark-field'])
         r = search(query,
                 params=params,
                 callback=callback,
                 mine_ids=args['--mine-ids'],
                 info_only=info_only,
+                journal=args['--journal'],
+                cursor=args['--cursor'],
+                partitions=args['--partitions'],
+                watermark=watermark,
                 max_tasks=args['--workers'],
+                min_tasks=args['--min-workers'],
+                adaptive=args['--adaptive'],
+                max_connections=args['--connections'],
+                connections_per_host=args['--host-connections'],
+                dedupe=args['--dedupe'],
+                dedupe_fpr=args['--dedupe-fpr'],
+                cache=args['--cache-dir'],
+                cache_size=args['--cache-size'],
+                cache_ttl=args['--cache-ttl'],
+                sink=sink,
+                stats_interval=args['--stats-interval'],
+                metrics_file=args['--metrics-file'],
                 retries=args['--retries'],
                 config_file=args['--config-file'],
                 secure=args['--secure'],
@@ -153,8 +301,26 @@ def main(argv=None, session=None):
             if (not os.fstat(sys.stdin.fileno()).st_size > 0) and (sys.stdin.seekable()):
                 sys.exit(2)
 
+        # docopt repeats some --field values when the option is given
+        # more than once, drop the duplicates.
+        fields = list(OrderedDict.fromkeys(args['--field']))
         mine_items(args['<itemlist>'],
+                   journal=args['--journal'],
+                   processes=args['--processes'],
+                   fields=fields,
                    max_tasks=args['--workers'],
+                   min_tasks=args['--min-workers'],
+                   adaptive=args['--adaptive'],
+                   max_connections=args['--connections'],
+                   connections_per_host=args['--host-connections'],
+                   dedupe=args['--dedupe'],
+                   dedupe_fpr=args['--dedupe-fpr'],
+                   cache=args['--cache-dir'],
+                   cache_size=args['--cache-size'],
+                   cache_ttl=args['--cache-ttl'],
+                   sink=sink,
+                   stats_interval=args['--stats-interval'],
+                   metrics_file=args['--metrics-file'],
                    retries=args['--retries'],
                    secure=args['--secure'],
                    hosts=args['--hosts'],
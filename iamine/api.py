@@ -1,12 +1,15 @@
+import os
 import signal
 from getpass import getpass
 
 from .core import Miner, ItemMiner, SearchMiner
+from .multiprocess import mine_items_in_processes
 from .config import write_config_file
+from .watermark import Watermark
 
 
 def search(query=None, params=None, callback=None, mine_ids=None, info_only=None,
-           **kwargs):
+           journal=None, cursor=None, partitions=None, watermark=None, **kwargs):
     """Mine Archive.org search results.
 
     :param query: (optional) The Archive.org search query to yield
@@ -20,7 +23,11 @@ def search(query=None, params=None, callback=None, mine_ids=None, info_only=None
     :type params: dict
 
     :param callback: (optional) A callback function to be called on each
-                     :py:class:`aiohttp.client.ClientResponse`.
+                     :py:class:`aiohttp.client.ClientResponse`. A plain
+                     (non-coroutine) function is instead called with the
+                     response body and URL in a pool of threads, or of
+                     processes, set by the ``callback_pool`` miner
+                     argument. Anything it returns is output as a record.
 
     :param mine_ids: (optional) By default, ``search`` mines through
                      search results. To mine through the item metadata
@@ -33,6 +40,31 @@ def search(query=None, params=None, callback=None, mine_ids=None, info_only=None
                       or search results.
     :type info_only: bool
 
+    :param journal: (optional) A file to record completed work in, so
+                    that an interrupted run can be resumed. Finished
+                    search pages are recorded, or mined identifiers if
+                    ``mine_ids`` is ``True``.
+    :type journal: str
+
+    :param cursor: (optional) Set to ``True`` to page through results
+                   with the scrape API's cursor rather than page numbers.
+                   This is much faster for large result sets. Without a
+                   callback, each search result is output separately.
+    :type cursor: bool
+
+    :param partitions: (optional) Split the query into this many disjoint
+                       sub-queries of similar size, and page through them
+                       concurrently with cursors. Results are merged and
+                       deduplicated.
+    :type partitions: int
+
+    :param watermark: (optional) A file to keep the latest
+                      ``oai_updatedate`` seen in, or a
+                      :class:`iamine.watermark.Watermark`. The search is
+                      limited to items updated since the last run, and
+                      the watermark is moved forward if the run succeeds.
+    :type watermark: str
+
     :param \*\*kwargs: (optional) Arguments that ``get_miner`` takes.
     """
     query = '(*:*)' if not query else query
@@ -40,8 +72,12 @@ def search(query=None, params=None, callback=None, mine_ids=None, info_only=None
     mine_ids = True if mine_ids else False
     info_only = True if info_only else False
     miner = SearchMiner(**kwargs)
+    if watermark and not isinstance(watermark, Watermark):
+        watermark = Watermark(watermark)
 
     if info_only:
+        if watermark:
+            query = watermark.restrict(query)
         params = miner.get_search_params(query, params)
         r = miner.get_search_info(params)
         search_info = r.get('responseHeader')
@@ -49,9 +85,11 @@ def search(query=None, params=None, callback=None, mine_ids=None, info_only=None
         return search_info
 
     try:
-        miner.loop.add_signal_handler(signal.SIGINT, miner.close)
+        miner.loop.add_signal_handler(signal.SIGINT, miner.stop)
         miner.loop.run_until_complete(
-                miner.search(query, params=params, callback=callback, mine_ids=mine_ids))
+                miner.search(query, params=params, callback=callback, mine_ids=mine_ids,
+                             journal=journal, cursor=cursor, partitions=partitions,
+                             watermark=watermark))
     except RuntimeError:
         pass
 
@@ -73,13 +111,14 @@ def mine_urls(urls, params=None, callback=None, **kwargs):
     """
     miner = Miner(**kwargs)
     try:
-        miner.loop.add_signal_handler(signal.SIGINT, miner.close)
+        miner.loop.add_signal_handler(signal.SIGINT, miner.stop)
         miner.loop.run_until_complete(miner.mine_urls(urls, params, callback))
     except RuntimeError:
         pass
 
 
-def mine_items(identifiers, params=None, callback=None, **kwargs):
+def mine_items(identifiers, params=None, callback=None, journal=None, processes=None,
+               fields=None, **kwargs):
     """Concurrently retrieve metadata from Archive.org items.
 
     :param identifiers: A set of Archive.org item identifiers to mine.
@@ -90,17 +129,113 @@ def mine_items(identifiers, params=None, callback=None, **kwargs):
     :type params: dict
 
     :param callback: (optional) A callback function to be called on each
-                     :py:class:`aiohttp.client.ClientResponse`.
+                     :py:class:`aiohttp.client.ClientResponse`. A plain
+                     (non-coroutine) function is instead called with the
+                     response body and URL in a pool of threads, or of
+                     processes, set by the ``callback_pool`` miner
+                     argument. Anything it returns is output as a record.
+
+    :param journal: (optional) A file to record mined identifiers in.
+                    Identifiers already in the journal are skipped, so an
+                    interrupted run can be resumed.
+    :type journal: str
+
+    :param processes: (optional) Mine with this many processes, each
+                      mining a part of ``identifiers`` and using an equal
+                      share of the rate limit. ``identifiers`` must be the
+                      path to an itemlist, or a file opened from one.
+    :type processes: int
+
+    :param fields: (optional) Only output these fields of each item, e.g.
+                   ``metadata.title`` or ``files[].name``.
+    :type fields: list
 
     :param \*\*kwargs: (optional) Arguments that ``get_miner`` takes.
     """
+    if processes and processes > 1:
+        path = identifiers if isinstance(identifiers, str) else getattr(identifiers, 'name', None)
+        if (not isinstance(path, str)) or (not os.path.isfile(path)):
+            raise ValueError('Mining with multiple processes requires an itemlist file.')
+        return mine_items_in_processes(path, processes, params, callback, journal, fields,
+                                       **kwargs)
+
     miner = ItemMiner(**kwargs)
     try:
-        miner.loop.run_until_complete(miner.mine_items(identifiers, params, callback))
+        miner.loop.run_until_complete(
+                miner.mine_items(identifiers, params, callback, journal=journal,
+                                 fields=fields))
     except RuntimeError:
         miner.loop.close()
 
 
+def iter_items(identifiers, params=None, journal=None, fields=None, buffer_size=None,
+               **kwargs):
+    """Retrieve metadata from Archive.org items, and iterate over it as
+    it is retrieved.
+
+    Usage::
+
+        >>> for item in iter_items(['nasa', 'stats']):
+        ...     print(item['metadata']['title'])
+
+    :param identifiers: A set of Archive.org item identifiers to mine.
+    :type identifiers: iterable
+
+    :param params: (optional) The URL parameters to send with each
+                   request.
+    :type params: dict
+
+    :param journal: (optional) A file to record mined identifiers in.
+    :type journal: str
+
+    :param fields: (optional) Only return these fields of each item.
+    :type fields: list
+
+    :param buffer_size: (optional) The number of items to buffer. Mining
+                        pauses while the buffer is full. Defaults to 1000.
+    :type buffer_size: int
+
+    :param \*\*kwargs: (optional) Arguments that ``get_miner`` takes.
+
+    :rtype: :class:`iamine.records.Records`
+    :returns: An iterator of decoded items, which can also be used with
+              ``async for``.
+    """
+    miner = ItemMiner(**kwargs)
+    return miner.iter_items(identifiers, params, journal=journal, fields=fields,
+                            buffer_size=buffer_size)
+
+
+def iter_search(query=None, params=None, mine_ids=None, journal=None, cursor=None,
+                partitions=None, watermark=None, buffer_size=None, **kwargs):
+    """Mine Archive.org search results, and iterate over them as they are
+    retrieved. Takes the same arguments as :func:`search`, apart from
+    ``callback`` and ``info_only``.
+
+    Usage::
+
+        >>> for doc in iter_search('collection:nasa', cursor=True):
+        ...     print(doc['identifier'])
+
+    :param buffer_size: (optional) The number of records to buffer.
+                        Mining pauses while the buffer is full. Defaults
+                        to 1000.
+    :type buffer_size: int
+
+    :rtype: :class:`iamine.records.Records`
+    :returns: An iterator of decoded search results (or items, if
+              ``mine_ids`` is ``True``), which can also be used with
+              ``async for``.
+    """
+    query = '(*:*)' if not query else query
+    params = params if params else {}
+    mine_ids = True if mine_ids else False
+    miner = SearchMiner(**kwargs)
+    return miner.iter_search(query, params, mine_ids=mine_ids, journal=journal,
+                             cursor=cursor, partitions=partitions, watermark=watermark,
+                             buffer_size=buffer_size)
+
+
 def configure(username=None, password=None, overwrite=None, config_file=None):
     """Configure IA Mine with your Archive.org credentials."""
     username = input('Email address: ') if not username else username
@@ -0,0 +1,293 @@
+import os
+import time
+import hashlib
+import asyncio
+try:
+    import ujson as json
+except ImportError:
+    import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlencode
+
+
+class CachedResponse(object):
+    """A stand-in for :py:class:`aiohttp.client.ClientResponse`, used to
+    pass a cached body to response handlers and callbacks.
+    """
+
+    def __init__(self, url, body, headers=None):
+        self.url = url
+        self.status = 200
+        self.headers = {} if not headers else headers
+        self._content = body
+
+    @asyncio.coroutine
+    def read(self):
+        return self._content
+
+    @asyncio.coroutine
+    def text(self, encoding=None):
+        return self._content.decode(encoding if encoding else 'utf-8')
+
+    @asyncio.coroutine
+    def json(self, *, encoding=None, loads=json.loads):
+        return loads(self._content.decode(encoding if encoding else 'utf-8'))
+
+    def close(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class MetadataCache(object):
+    """A persistent on-disk cache of response bodies.
+
+    Entries are keyed by URL path and parameters (the host is ignored, so
+    entries are shared across ``hosts``). An entry younger than ``ttl``
+    is served without a request. Older entries are revalidated with
+    ``If-None-Match``/``If-Modified-Since``, so unchanged items cost a
+    304. The least recently used entries are evicted once the cache
+    grows past ``max_size`` bytes.
+
+    Entries are read and written on a thread of the cache's own, so disk
+    I/O never blocks the event loop. That thread is the only one to
+    touch the files and the index of entries.
+
+    :param directory: The directory to store the cache in.
+    :type directory: str
+
+    :param max_size: (optional) The maximum size of the cache in bytes.
+                     Defaults to 1GB.
+    :type max_size: int
+
+    :param ttl: (optional) The number of seconds an entry is served
+                without revalidation. By default, entries are always
+                revalidated.
+    :type ttl: int
+    """
+
+    def __init__(self, directory, max_size=None, ttl=None):
+        max_size = (1024 ** 3) if not max_size else max_size
+        ttl = 0 if not ttl else ttl
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        # Maps keys to entry sizes, least recently used first.
+        self._entries = OrderedDict()
+        self._load()
+        # Started on first use, so caches made before forking each get
+        # their own.
+        self._executor = None
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.entry'):
+                continue
+            st = os.stat(os.path.join(self.directory, name))
+            entries.append((st.st_mtime, name[:-len('.entry')], st.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self.size += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.entry'.format(key))
+
+    def key(self, url, params=None):
+        """Make a cache key for a URL and its parameters.
+
+        :rtype: str
+        """
+        parts = urlsplit(url)
+        s = '{}?{}&{}'.format(parts.path, parts.query,
+                              urlencode(sorted((params or {}).items())))
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    @asyncio.coroutine
+    def _run(self, f, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_event_loop()
+        return (yield from loop.run_in_executor(self._executor, f, *args))
+
+    @asyncio.coroutine
+    def get(self, key):
+        """Get a cache entry.
+
+        :rtype: dict
+        :returns: The entry's headers, with the cached body under
+                  ``body``, or ``None`` if there is no entry for ``key``.
+        """
+        return (yield from self._run(self._read, key))
+
+    def _read(self, key):
+        if key not in self._entries:
+            return None
+        try:
+            with open(self._path(key), 'rb') as fh:
+                entry = json.loads(fh.readline().decode('utf-8'))
+                entry['body'] = fh.read()
+        except (OSError, ValueError):
+            self._remove(key)
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return (time.time() - entry.get('stored', 0)) < self.ttl
+
+    def validators(self, entry):
+        """Get the conditional request headers for revalidating an entry.
+
+        :rtype: dict
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    @asyncio.coroutine
+    def hit(self, key, entry):
+        """Record that ``entry`` was served without a request."""
+        self.hits += 1
+        self.bytes_saved += len(entry['body'])
+        yield from self._run(self._touch, key)
+
+    @asyncio.coroutine
+    def revalidate(self, key, entry):
+        """Record that ``entry`` was revalidated by a 304 response."""
+        self.revalidated += 1
+        self.bytes_saved += len(entry['body'])
+        entry['stored'] = time.time()
+        yield from self._run(self._write, key, entry)
+
+    @asyncio.coroutine
+    def store(self, key, body, headers):
+        """Store a response body fetched from the server.
+
+        :param headers: The response headers.
+        """
+        self.misses += 1
+        entry = dict(
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+            stored=time.time(),
+            body=body,
+        )
+        yield from self._run(self._write, key, entry)
+
+    def _write(self, key, entry):
+        meta = dict((k, v) for k, v in entry.items() if k != 'body')
+        data = json.dumps(meta).encode('utf-8') + b'\n' + entry['body']
+        path = self._path(key)
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+        self.size += len(data) - self._entries.pop(key, 0)
+        self._entries[key] = len(data)
+        self._evict()
+
+    def _touch(self, key):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while (self.size > self.max_size) and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    def close(self):
+        """Wait for any entries being written, and stop the cache's
+        thread.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            revalidated=self.revalidated,
+            misses=self.misses,
+            bytes_saved=self.bytes_saved,
+            size=self.size,
+            entries=len(self._entries),
+        )
+
+
+class LookupCache(object):
+    """A small on-disk cache of the lookups a miner makes before it
+    starts, i.e. the credentials check and the global rate limit, so
+    short runs can skip them.
+
+    :param path: (optional) The file to store lookups in. Defaults to
+                 ``$XDG_CACHE_HOME/iamine/lookups.json``.
+    :type path: str
+
+    :param ttl: (optional) The number of seconds a lookup is reused for.
+                Defaults to 3600.
+    :type ttl: int
+    """
+
+    def __init__(self, path=None, ttl=None):
+        if not path:
+            cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+            path = os.path.join(cache_home, 'iamine', 'lookups.json')
+        ttl = 3600 if not ttl else ttl
+
+        self.path = path
+        self.ttl = ttl
+
+    def _read(self):
+        try:
+            with open(self.path) as fh:
+                return json.loads(fh.read())
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        """Get a lookup's value, or ``None`` if it isn't cached or has
+        expired.
+        """
+        entry = self._read().get(key)
+        if (not entry) or ((time.time() - entry.get('time', 0)) > self.ttl):
+            return None
+        return entry.get('value')
+
+    def set(self, key, value):
+        """Cache a lookup's value. Failing to write the cache is not an
+        error, the lookup is just made again next time.
+        """
+        lookups = self._read()
+        lookups[key] = dict(value=value, time=time.time())
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, 'w') as fh:
+                fh.write(json.dumps(lookups))
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
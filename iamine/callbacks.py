@@ -0,0 +1,121 @@
+import sys
+import inspect
+import asyncio
+import traceback
+try:
+    import ujson as json
+except ImportError:
+    import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def is_sync_callback(callback):
+    """Check whether a callback is a plain function, rather than a
+    coroutine function that takes the response.
+
+    :rtype: bool
+    """
+    return not (asyncio.iscoroutinefunction(callback)
+                or inspect.isgeneratorfunction(callback))
+
+
+class CallbackPool(object):
+    """Run plain (synchronous) callbacks in a pool of threads or
+    processes, so they don't hold up the event loop.
+
+    Callbacks are called with the response body (``bytes``) and the
+    URL, and their return value, if not ``None``, is written to the sink
+    as a record. Strings and bytes are taken to be JSON documents already,
+    anything else is encoded as JSON. At most ``max_pending`` callbacks are queued or running
+    at once. When the pool is full, the request waits for a free slot,
+    so slow callbacks slow down fetching rather than piling up bodies in
+    memory.
+
+    Exceptions raised by callbacks are logged to stderr. The request is
+    not retried.
+
+    :param workers: (optional) The number of threads or processes.
+                    Defaults to 4.
+    :type workers: int
+
+    :param processes: (optional) Use processes rather than threads, for
+                      callbacks that are CPU bound. Callbacks must then
+                      be picklable, i.e. defined at module level.
+    :type processes: bool
+
+    :param max_pending: (optional) Defaults to twice ``workers``.
+    :type max_pending: int
+    """
+
+    def __init__(self, workers=None, processes=None, max_pending=None, loop=None):
+        workers = 4 if not workers else workers
+        max_pending = (workers * 2) if not max_pending else max_pending
+        loop = asyncio.get_event_loop() if not loop else loop
+
+        self.workers = workers
+        self.processes = True if processes else False
+        self.loop = loop
+        self._slots = asyncio.Semaphore(max_pending, loop=loop)
+        self._pending = set()
+        # Started on first use, so miners that don't use it don't pay
+        # for threads or processes.
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+            self._executor = executor(max_workers=self.workers)
+        return self._executor
+
+    @asyncio.coroutine
+    def submit(self, callback, body, url, sink=None, key=None, done=None):
+        """Queue a callback, waiting for a free slot if the pool is full.
+
+        :param sink: (optional) The sink to write the callback's return
+                     value to.
+        :type sink: :class:`iamine.sinks.Sink`
+
+        :param key: (optional) The key to write the return value with.
+        :type key: str
+
+        :param done: (optional) A function to call once the callback has
+                     returned and its return value has been written. It
+                     isn't called if the callback fails.
+        """
+        yield from self._slots.acquire()
+        task = asyncio.Task(self._run(callback, body, url, sink, key, done), loop=self.loop)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    @asyncio.coroutine
+    def _run(self, callback, body, url, sink, key, done):
+        try:
+            result = yield from self.loop.run_in_executor(self._get_executor(), callback,
+                                                          body, url)
+            if (result is not None) and sink:
+                if not isinstance(result, (str, bytes)):
+                    result = json.dumps(result)
+                yield from sink.write(result, key=key)
+            if done is not None:
+                done()
+        except Exception as exc:
+            sys.stderr.write('{}\n'.format(json.dumps(dict(
+                url=url,
+                message='Callback failed.',
+                callback=repr(callback),
+                exception=repr(exc),
+                traceback=traceback.format_exc(),
+            ))))
+        finally:
+            self._slots.release()
+
+    @asyncio.coroutine
+    def join(self):
+        """Wait for every queued callback to finish."""
+        while self._pending:
+            yield from asyncio.wait(list(self._pending), loop=self.loop)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,101 @@
+import asyncio
+from collections import deque
+
+
+class AIMDController(object):
+    """Adjust the number of requests in flight to the network's capacity.
+
+    The limit starts at ``floor`` and doubles every round trip (slow
+    start) until the first sign of congestion. After that, it grows by
+    one every round trip (additive increase), and is halved on
+    congestion (multiplicative decrease). At most one decrease is made
+    per ``cooldown`` seconds, so a burst of failures from requests
+    already in flight counts as a single congestion event.
+
+    Congestion is a 429 or 5xx response, a failed or timed out request,
+    or the smoothed latency rising to ``latency_tolerance`` times its
+    lowest observed value.
+
+    :param floor: The minimum number of requests in flight.
+    :type floor: int
+
+    :param ceiling: The maximum number of requests in flight.
+    :type ceiling: int
+
+    :param latency_tolerance: (optional) Defaults to 3.
+    :type latency_tolerance: float
+
+    :param cooldown: (optional) Defaults to 1 second.
+    :type cooldown: float
+    """
+
+    def __init__(self, floor, ceiling, loop=None, latency_tolerance=None,
+                 cooldown=None):
+        loop = asyncio.get_event_loop() if not loop else loop
+        latency_tolerance = 3.0 if not latency_tolerance else latency_tolerance
+        cooldown = 1.0 if not cooldown else cooldown
+
+        self.loop = loop
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+
+        self.limit = float(self.floor)
+        self.active = 0
+        self.latency = None
+        self.min_latency = None
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._waiters = deque()
+
+    @asyncio.coroutine
+    def acquire(self):
+        """Wait until a request may be made."""
+        while self.active >= int(self.limit):
+            waiter = asyncio.Future(loop=self.loop)
+            self._waiters.append(waiter)
+            yield from waiter
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.active
+        while (free > 0) and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _congested(self, status, latency):
+        if (status is None) or (status == 429) or (status >= 500):
+            return True
+        self.latency = latency if self.latency is None else \
+            (0.9 * self.latency) + (0.1 * latency)
+        if (self.min_latency is None) or (self.latency < self.min_latency):
+            self.min_latency = self.latency
+        return self.latency > (self.latency_tolerance * self.min_latency)
+
+    def record(self, status, latency):
+        """Adjust the limit after a request.
+
+        :param status: The response's status code, or ``None`` if the
+                       request failed.
+        :type status: int
+
+        :param latency: The number of seconds the request took.
+        :type latency: float
+        """
+        if self._congested(status, latency):
+            now = self.loop.time()
+            if (now - self._last_decrease) >= self.cooldown:
+                self._last_decrease = now
+                self._slow_start = False
+                self.limit = max(float(self.floor), self.limit / 2.0)
+        else:
+            step = 1.0 if self._slow_start else (1.0 / self.limit)
+            self.limit = min(float(self.ceiling), self.limit + step)
+            self._wake()
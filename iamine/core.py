@@ -1,29 +1,67 @@
+import sys
+import urllib.parse
 import urllib.request
 try:
     import ujson as json
 except ImportError:
     import json
+import heapq
+import hashlib
 import asyncio
+import itertools
 try:
     from asyncio import JoinableQueue as Queue
 except ImportError:
     from asyncio import Queue
 from copy import deepcopy
-import time
 
 import aiohttp
 
 from .config import get_config
-from .requests import MineRequest
-from .urls import metadata_urls, make_url
-from .exceptions import AuthenticationError
+from .requests import MineRequest, RequestContext
+from .ratelimit import TokenBucket
+from .journal import Journal
+from .cache import MetadataCache, LookupCache
+from .sinks import StreamSink, QueueSink
+from .records import Records
+from .concurrency import AIMDController
+from .metrics import Metrics
+from .hosts import HostPool
+from .projection import Projection
+from .callbacks import CallbackPool, is_sync_callback
+from .dedupe import SpillingSet, BloomFilter
+from .watermark import Watermark
+from .urls import make_url
+from .exceptions import AuthenticationError, SinkError
 
 
 class Miner(object):
 
+    # The endpoints used to check credentials and to read the global
+    # rate limit. They can be overridden to mine from a local stand-in
+    # server, as the benchmarks do.
+    check_auth_url = '{protocol}s3.us.archive.org?check_auth=1'
+    rate_limit_url = 'https://archive.org/metadata/iamine-rate-limiter'
+
     def __init__(self,
                  loop=None,
                  max_tasks=None,
+                 min_tasks=None,
+                 adaptive=None,
+                 queue_size=None,
+                 max_connections=None,
+                 connections_per_host=None,
+                 keepalive_timeout=None,
+                 dedupe=None,
+                 dedupe_fpr=None,
+                 cache=None,
+                 cache_size=None,
+                 cache_ttl=None,
+                 sink=None,
+                 callback_pool=None,
+                 stats_interval=None,
+                 metrics_file=None,
+                 rate_share=None,
                  retries=None,
                  secure=None,
                  hosts=None,
@@ -37,7 +75,12 @@ class Miner(object):
         # Set default values for kwargs.
         loop = asyncio.get_event_loop() if not loop else loop
         max_tasks = 100 if not max_tasks else max_tasks
+        min_tasks = min(4, max_tasks) if not min_tasks else min_tasks
+        queue_size = (max_tasks * 2) if not queue_size else queue_size
+        max_connections = max_tasks if not max_connections else max_connections
+        keepalive_timeout = 30 if not keepalive_timeout else keepalive_timeout
         max_retries = 10 if not retries else retries
+        rate_share = 1.0 if not rate_share else rate_share
         protocol = 'http://' if not secure else 'https://'
         config = get_config(config, config_file)
         access = config.get('s3', {}).get('access', access)
@@ -46,95 +89,483 @@ class Miner(object):
 
         self.max_tasks = max_tasks
         self.max_retries = max_retries
+        self.rate_share = rate_share
         self.protocol = protocol
         self.hosts = hosts
+        # With several hosts, each request's host is picked when it is
+        # made, from the hosts that are healthy and least loaded.
+        self.host_pool = HostPool(hosts) if hosts and (len(hosts) > 1) else None
         self.config = config
         self.access = access
         self.debug = debug
         self.cookies = config.get('cookies', {})
+        self.journal = None
+
+        # Identifiers already seen in this run are skipped. Exactly, with
+        # a set that spills to disk, or with a Bloom filter if a false
+        # positive rate is given.
+        self.dedupe = None
+        if dedupe or dedupe_fpr:
+            self.dedupe = BloomFilter(dedupe_fpr) if dedupe_fpr else SpillingSet()
+
+        # Local metadata cache.
+        if cache and not isinstance(cache, MetadataCache):
+            cache = MetadataCache(cache, cache_size, cache_ttl)
+        self.cache = cache if cache else None
+
+        # Output. Records are written to stdout by default.
+        self.sink = StreamSink(loop=loop) if not sink else sink
+
+        # Plain (non-coroutine) callbacks run in a bounded pool of
+        # threads, or processes, so they don't block the event loop.
+        # An int is the number of threads.
+        if not isinstance(callback_pool, CallbackPool):
+            callback_pool = CallbackPool(callback_pool, loop=loop)
+        self.callback_pool = callback_pool
 
-        # Asyncio/Aiohttp settings.
-        self.connector = aiohttp.TCPConnector(share_cookies=True, loop=loop)
-        self.connector.update_cookies(self.cookies)
+        # Metrics are always collected, and reported every stats_interval
+        # seconds (as a JSON line on stderr) and/or written to a
+        # Prometheus textfile.
+        self.metrics = Metrics(gauges=self.gauges, hosts=self.host_pool)
+        self.stats_interval = stats_interval
+        self.metrics_file = metrics_file
+        self._active = 0
+        self._reporter = None
+
+        # Asyncio/Aiohttp settings. Every request goes through one
+        # long-lived session, so connections (and TLS sessions) are kept
+        # alive and reused. ``limit`` is a per-host limit in aiohttp, the
+        # total number of open connections is capped by a semaphore.
+        self.connector = aiohttp.TCPConnector(limit=connections_per_host,
+                                              keepalive_timeout=keepalive_timeout,
+                                              use_dns_cache=True,
+                                              loop=loop)
+        self.session = aiohttp.ClientSession(connector=self.connector,
+                                             cookies=self.cookies,
+                                             loop=loop)
         self.loop = loop
-        self.q = Queue(1000, loop=self.loop)
-        self.q = Queue(loop=self.loop)
+        self._connections = asyncio.Semaphore(max_connections, loop=loop)
+        # With adaptive concurrency, max_tasks workers are started but the
+        # number of requests in flight is set by the controller.
+        self.controller = None
+        if adaptive:
+            self.controller = AIMDController(min_tasks, max_tasks, loop=loop)
+        # Bounded, so requests are only pulled from the producer as
+        # workers free up.
+        self.q = Queue(queue_size, loop=self.loop)
 
-        # Require valid access key!
-        self.assert_s3_keys_valid(access, secret)
+        # Failed requests wait in a heap, keyed by the time they are due
+        # to be retried, rather than holding up a worker.
+        self._retry_heap = []
+        self._retry_seq = itertools.count()
+        self._retry_added = asyncio.Event(loop=self.loop)
+        self._no_retries = asyncio.Event(loop=self.loop)
+        self._no_retries.set()
+        self._retrying = 0
+        self._retry_scheduler = None
 
-        # Rate limiting.
-        self._max_per_second = self.get_global_rate_limit()
-        self._min_interval = 1.0 / float(self._max_per_second)
-        self._last_time_called = 0.0
+        # The access keys are checked and the rate limit is looked up
+        # by start(), when the first request is made, so miners that
+        # never make a request (e.g. for --num-found) don't wait on them.
+        # Both lookups are cached on disk.
+        self.secret = secret
+        self.lookups = LookupCache()
+        self.rate_limiter = None
+        self._started = None
+        self._closed = False
 
     def close(self):
-        self.connector.close()
+        """Stop the background tasks, and close everything the miner has
+        open, once mining is done. Calling it again does nothing.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.stop_background_tasks()
+        self.callback_pool.close()
+        # Closing the sink journals the last records written, so it is
+        # closed before the journal.
+        self.sink.close()
+        self.close_journal()
+        self.close_dedupe()
+        self.close_cache()
+        self.session.close()
+        self.log_cache_stats()
+
+    def stop(self):
+        """Close the miner and stop its loop, e.g. on SIGINT."""
+        self.close()
         self.loop.stop()
-        self.loop.close()
 
+    @asyncio.coroutine
+    def start(self):
+        """Check the access keys and look up the rate limit, at the same
+        time. This is done once, before the first request is made.
+
+        :raises AuthenticationError: If the access keys aren't valid.
+        """
+        if self._started is None:
+            self._started = asyncio.Task(self._start(), loop=self.loop)
+        yield from self._started
+
+    @asyncio.coroutine
+    def _start(self):
+        _, rate = yield from asyncio.gather(
+                self.assert_s3_keys_valid(self.access, self.secret),
+                self.fetch_global_rate_limit(),
+                loop=self.loop)
+        # Rate limiting, shared by all workers. The global rate limit
+        # is re-read periodically so long runs pick up changes.
+        self.rate_limiter = TokenBucket(max(1.0, rate * self.rate_share),
+                                        loop=self.loop,
+                                        refresh=self.get_rate_limit)
+
+    @asyncio.coroutine
+    def _get_json(self, url, headers=None):
+        resp = yield from self.session.get(url, headers=headers)
+        try:
+            return json.loads((yield from resp.read()).decode('utf-8'))
+        finally:
+            resp.close()
+
+    @asyncio.coroutine
     def assert_s3_keys_valid(self, access, secret):
-        url = '{}s3.us.archive.org?check_auth=1'.format(self.protocol)
-        r = urllib.request.Request(url)
-        r.add_header('Authorization', 'LOW {0}:{1}'.format(access, secret))
-        f = urllib.request.urlopen(r)
-        j = json.loads(f.read().decode('utf-8'))
+        """Check the access keys with Archive.org, unless they were
+        checked recently.
+
+        :raises AuthenticationError: If the access keys aren't valid.
+        """
+        url = self.check_auth_url.format(protocol=self.protocol)
+        keys = '{} {}:{}'.format(url, access, secret).encode('utf-8')
+        key = 'auth:{}'.format(hashlib.sha1(keys).hexdigest())
+        if self.lookups.get(key):
+            return
+        headers = {'Authorization': 'LOW {0}:{1}'.format(access, secret)}
+        j = yield from self._get_json(url, headers)
         if j.get('authorized') is not True:
             raise AuthenticationError(j.get('error'))
+        self.lookups.set(key, True)
+
+    @staticmethod
+    def _parse_rate_limit(j):
+        return int(j.get('metadata', {}).get('rate_per_second', 300))
+
+    @asyncio.coroutine
+    def fetch_global_rate_limit(self):
+        """Get the global rate limit per client, unless it was looked
+        up recently.
+
+        :rtype: int
+        """
+        key = 'rate_limit:{}'.format(self.rate_limit_url)
+        rate = self.lookups.get(key)
+        if rate is None:
+            rate = self._parse_rate_limit((yield from self._get_json(self.rate_limit_url)))
+            self.lookups.set(key, rate)
+        return rate
 
     def get_global_rate_limit(self):
-        """Get the global rate limit per client.
+        """Get the global rate limit per client. This blocks, and is
+        used to refresh the rate limit from another thread.
 
         :rtype: int
         :returns: The global rate limit for each client.
         """
-        r = urllib.request.urlopen('https://archive.org/metadata/iamine-rate-limiter')
-        j = json.loads(r.read().decode('utf-8'))
-        return int(j.get('metadata', {}).get('rate_per_second', 300))
+        r = urllib.request.urlopen(self.rate_limit_url)
+        rate = self._parse_rate_limit(json.loads(r.read().decode('utf-8')))
+        self.lookups.set('rate_limit:{}'.format(self.rate_limit_url), rate)
+        return rate
+
+    def get_rate_limit(self):
+        """Get this miner's share of the global rate limit, for when
+        several miners (e.g. one per process) share one client's limit.
+
+        :rtype: float
+        """
+        return max(1.0, self.get_global_rate_limit() * self.rate_share)
+
+    def observe(self, request, status, latency, exc=None, size=None):
+        """Called by :class:`MineRequest` after every attempt.
+
+        :param status: The response's status code, or ``None`` if no
+                       response was received.
+        :type status: int
+
+        :param latency: The number of seconds until the response was
+                        received, or the request failed.
+        :type latency: float
+
+        :param exc: (optional) The exception raised by the attempt, if
+                    any.
+
+        :param size: (optional) The size of the response body in bytes.
+        :type size: int
+        """
+        self.metrics.record(request.url, status, latency, size)
+        if self.host_pool:
+            host = urllib.parse.urlsplit(request.url).netloc
+            if host in self.host_pool:
+                self.host_pool.record(host, status, latency)
+        if self.controller:
+            self.controller.record(status, latency)
+
+    def request_context(self, **kwargs):
+        """Make a :class:`iamine.requests.RequestContext` for requests
+        made by this miner, to be shared by many of them.
+
+        :param \*\*kwargs: (optional) Arguments that
+                           :class:`iamine.requests.RequestContext` takes,
+                           other than those the miner sets.
+        """
+        return RequestContext(self.access,
+                              session=self.session,
+                              journal=self.journal,
+                              observer=self.observe,
+                              callback_pool=self.callback_pool,
+                              max_retries=self.max_retries,
+                              debug=self.debug,
+                              **kwargs)
+
+    def make_url(self, path):
+        """Make an URL for a request. When mining from several hosts,
+        the URL's host is replaced by :meth:`_pick_host` when the request
+        is made.
+        """
+        return make_url(path, self.protocol, self.hosts[:1] if self.hosts else None)
+
+    def _pick_host(self, request):
+        """Point a request at the best host to send it to now.
 
-    def _rate_limited():
-        """A rate limit decorator for limiting the number of times the
-        decorated :class:`Miner` method can be called. Limits are set in
-        :attr:`Miner._max_per_second`.
+        :returns: The host picked, or ``None`` if the request isn't for
+                  one of the miner's hosts.
         """
-        def decorate(func):
-            def rate_limited_func(self, *args, **kwargs):
-                elapsed = time.monotonic() - self._last_time_called
-                self.left_to_wait = self._min_interval - elapsed
-                if self.left_to_wait > 0:
-                    time.sleep(self.left_to_wait)
-                func(self, *args, **kwargs)
-                self._last_time_called = time.monotonic()
-                yield from func(self, *args, **kwargs)
-            return rate_limited_func
-        return decorate
-
-    @_rate_limited()
+        if not self.host_pool:
+            return None
+        url = urllib.parse.urlsplit(request.url)
+        if url.netloc not in self.host_pool:
+            return None
+        host = self.host_pool.acquire()
+        request.url = urllib.parse.urlunsplit(url._replace(netloc=host))
+        return host
+
+    @asyncio.coroutine
+    def _attempt(self, request):
+        """Make one rate limited attempt at a request."""
+        if self.rate_limiter is None:
+            yield from self.start()
+        if self.controller:
+            yield from self.controller.acquire()
+        try:
+            yield from self.rate_limiter.acquire()
+            with (yield from self._connections):
+                host = self._pick_host(request)
+                self._active += 1
+                try:
+                    handled = yield from request.attempt()
+                finally:
+                    self._active -= 1
+                    if host:
+                        self.host_pool.release(host)
+        finally:
+            if self.controller:
+                self.controller.release()
+        return handled
+
+    @asyncio.coroutine
     def make_rate_limited_request(self, request):
-        yield from request.make_request()
+        """Make a rate limited request, retrying it with backoff until it
+        succeeds or runs out of retries. Used for requests whose result is
+        waited for, queued requests are retried by :meth:`work`.
+
+        :rtype: bool
+        :returns: ``True`` if the response was handled.
+        """
+        while True:
+            if (yield from self._attempt(request)):
+                return True
+            if request.retries >= request.max_retries:
+                self.give_up(request)
+                return False
+            self.metrics.retries += 1
+            yield from asyncio.sleep(request.retry_delay(), loop=self.loop)
+
+    def give_up(self, request):
+        self.metrics.give_ups += 1
+        request.give_up()
+
+    def schedule_retry(self, request, q):
+        """Put a failed request back into ``q`` once its retry delay has
+        passed.
+        """
+        self.metrics.retries += 1
+        due = self.loop.time() + request.retry_delay()
+        heapq.heappush(self._retry_heap, (due, next(self._retry_seq), request, q))
+        self._retrying += 1
+        self._no_retries.clear()
+        self._retry_added.set()
+
+    @asyncio.coroutine
+    def _schedule_retries(self):
+        while True:
+            if not self._retry_heap:
+                self._retry_added.clear()
+                yield from self._retry_added.wait()
+                continue
+            delay = self._retry_heap[0][0] - self.loop.time()
+            if delay > 0:
+                # Wake up early if a retry due sooner is added.
+                self._retry_added.clear()
+                try:
+                    yield from asyncio.wait_for(self._retry_added.wait(), delay,
+                                                loop=self.loop)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, request, q = heapq.heappop(self._retry_heap)
+            yield from q.put(request)
+            self._retrying -= 1
+            if not self._retrying:
+                self._no_retries.set()
+
+    def start_retry_scheduler(self):
+        if self._retry_scheduler is None:
+            self._retry_scheduler = asyncio.Task(self._schedule_retries(), loop=self.loop)
+
+    def stop_retry_scheduler(self):
+        if self._retry_scheduler is not None:
+            self._retry_scheduler.cancel()
+            self._retry_scheduler = None
+
+    def gauges(self):
+        """Get the current queue depths and number of requests in
+        flight, for reporting alongside :attr:`metrics`.
+
+        :rtype: dict
+        """
+        return dict(
+            queued_requests=self.q.qsize(),
+            retrying_requests=self._retrying,
+            active_requests=self._active,
+            concurrency_limit=int(self.controller.limit) if self.controller else None,
+        )
+
+    def report_metrics(self):
+        if self.stats_interval:
+            stats = self.metrics.report()
+            sys.stderr.write('{}\n'.format(json.dumps(dict(stats=stats))))
+        if self.metrics_file:
+            self.metrics.write_prometheus(self.metrics_file)
+
+    @asyncio.coroutine
+    def _report_metrics(self):
+        interval = self.stats_interval if self.stats_interval else 10
+        while True:
+            yield from asyncio.sleep(interval, loop=self.loop)
+            self.report_metrics()
+
+    def start_background_tasks(self):
+        self.start_retry_scheduler()
+        if (self._reporter is None) and (self.stats_interval or self.metrics_file):
+            self._reporter = asyncio.Task(self._report_metrics(), loop=self.loop)
+
+    def stop_background_tasks(self):
+        """Stop the retry scheduler and metrics reporter, and report the
+        final metrics.
+        """
+        self.stop_retry_scheduler()
+        if self._reporter is not None:
+            self._reporter.cancel()
+            self._reporter = None
+            self.report_metrics()
+
+    @asyncio.coroutine
+    def join(self, q):
+        """Wait until every request put into ``q`` has been handled,
+        including requests waiting to be retried.
+        """
+        while True:
+            yield from q.join()
+            if not self._retrying:
+                return
+            yield from self._no_retries.wait()
+
+    def open_journal(self, journal):
+        """Open a journal of completed requests, used to skip work
+        already done by an earlier, interrupted run.
+
+        :param journal: The path to the journal file, or a
+                        :class:`iamine.journal.Journal`.
+        """
+        # An empty journal is falsy, so only paths are tested for truth.
+        if isinstance(journal, str):
+            journal = Journal(journal) if journal else None
+        self.journal = journal
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def close_dedupe(self):
+        if self.dedupe is not None:
+            self.dedupe.close()
+
+    def close_cache(self):
+        if self.cache:
+            self.cache.close()
+
+    def use_queue_sink(self, buffer_size=None):
+        """Output records to a :class:`iamine.sinks.QueueSink` rather
+        than the miner's sink, to be iterated over.
+        """
+        self.sink.close()
+        self.sink = QueueSink(buffer_size, loop=self.loop)
+
+    def log_cache_stats(self):
+        if self.cache:
+            sys.stderr.write('{}\n'.format(json.dumps(dict(cache=self.cache.stats()))))
 
     @asyncio.coroutine
-    def work(self):
+    def work(self, q=None):
+        q = self.q if q is None else q
         while True:
-            request = yield from self.q.get()
-            yield from self.make_rate_limited_request(request)
-            self.q.task_done()
+            request = yield from q.get()
+            try:
+                if self.sink.error is not None:
+                    # The output has failed, so the queue is drained
+                    # without making requests, and the error is raised
+                    # by whatever is feeding the queue, or by the flush.
+                    continue
+                if not (yield from self._attempt(request)):
+                    if request.retries < request.max_retries:
+                        self.schedule_retry(request, q)
+                    else:
+                        self.give_up(request)
+            except SinkError:
+                pass
+            finally:
+                q.task_done()
 
     @asyncio.coroutine
     def q_requests(self, requests):
+        """Feed requests into the queue, waiting for a free slot before
+        pulling the next request from ``requests``.
+        """
         for req in requests:
-            self.q.put_nowait(req)
+            # Stop feeding the workers once the output has failed.
+            self.sink.check()
+            yield from self.q.put(req)
 
     @asyncio.coroutine
     def mine(self, requests):
+        yield from self.start()
+        self.start_background_tasks()
         workers = [asyncio.Task(self.work(), loop=self.loop)
                    for _ in range(self.max_tasks)]
         yield from self.q_requests(requests)
-
-        yield from self.q.join()
-        yield from asyncio.sleep(1)
-        while not self.q.empty():
-            yield from asyncio.sleep(1)
+        yield from self.join(self.q)
+        yield from self.callback_pool.join()
+        yield from self.sink.flush()
 
         for w in workers:
             w.cancel()
@@ -147,7 +578,8 @@ class ItemMiner(Miner):
         super(ItemMiner, self).__init__(**kwargs)
 
     @asyncio.coroutine
-    def mine_items(self, identifiers, params=None, callback=None):
+    def mine_items(self, identifiers, params=None, callback=None, journal=None,
+                   fields=None):
         """Mine metadata from Archive.org items.
 
         :param identifiers: Archive.org identifiers to be mined.
@@ -159,20 +591,62 @@ class ItemMiner(Miner):
 
         :param callback: A callback function to be called on each
                          :py:class:`aiohttp.client.ClientResponse`.
+                         A plain function is instead called with the
+                         response body and URL in a
+                         :class:`iamine.callbacks.CallbackPool`.
         :type callback: func
+
+        :param journal: (optional) A file to record mined identifiers
+                        in. Identifiers already in the journal are skipped.
+        :type journal: str
+
+        :param fields: (optional) Only output these fields of each item,
+                       e.g. ``metadata.title`` or ``files[].name``. See
+                       :class:`iamine.projection.Projection`. Ignored if
+                       there is a callback.
+        :type fields: list
         """
         # By default, don't cache item metadata in redis.
         params = {'dontcache': 1} if not params else {}
-        requests = metadata_requests(identifiers, params, callback, self)
-        yield from self.mine(requests)
+        self.open_journal(journal)
+        try:
+            projection = Projection(fields) if fields and not callback else None
+            requests = metadata_requests(identifiers, params, callback, self, projection)
+            yield from self.mine(requests)
+        finally:
+            self.close()
+
+    def iter_items(self, identifiers, params=None, journal=None, fields=None,
+                   buffer_size=None):
+        """Mine metadata from Archive.org items, and iterate over it as
+        it is mined. Takes the same arguments as :meth:`mine_items`,
+        apart from ``callback``.
+
+        :param buffer_size: (optional) The number of records to buffer.
+                            Mining pauses while the buffer is full.
+        :type buffer_size: int
+
+        :rtype: :class:`iamine.records.Records`
+        """
+        self.use_queue_sink(buffer_size)
+        return Records(self.mine_items(identifiers, params, journal=journal, fields=fields),
+                       self.sink, loop=self.loop)
+
+
+# The first characters of Archive.org identifiers, used to partition queries.
+IDENTIFIER_PREFIXES = '0123456789abcdefghijklmnopqrstuvwxyz'
 
 
 class SearchMiner(ItemMiner):
 
-    def __init__(self, **kwargs):
+    def __init__(self, max_pages=None, **kwargs):
         super(SearchMiner, self).__init__(**kwargs)
-        # Item mining queue.
-        self.iq = Queue(1000, loop=self.loop)
+        # The number of search pages requested at once when mining ids.
+        self.max_pages = 2 if not max_pages else max_pages
+        # Identifiers seen so far when merging partitioned searches.
+        self._seen = None
+        # The watermark of an incremental search.
+        self.watermark = None
 
     def get_search_params(self, query, params):
         default_rows = 500
@@ -200,18 +674,52 @@ class SearchMiner(ItemMiner):
         return json.loads(f.read().decode('utf-8'))
 
     @asyncio.coroutine
-    def _handle_search_results(self, resp, params=None, callback=None):
-        j = yield from resp.json(encoding='utf-8')
-        resp.close()
-        identifiers = []
-        for doc in j.get('response', {}).get('docs', []):
-            if not doc.get('identifier'):
-                continue
-            identifiers.append(doc['identifier'])
-        for req in metadata_requests(identifiers, params, callback, self):
-            self.iq.put_nowait(req)
+    def queue_items(self, identifiers, callback=None):
+        """Queue metadata requests for items found by a search, waiting
+        while the queue is full. Searching therefore goes no faster than
+        the workers can mine the items found.
+        """
+        for req in metadata_requests(identifiers, callback=callback, miner=self):
+            self.sink.check()
+            yield from self.q.put(req)
 
-    def search_requests(self, query=None, params=None, callback=None, mine_ids=None):
+    @asyncio.coroutine
+    def search_ids(self, query=None, params=None, callback=None):
+        """Page through Advancedsearch API results, and mine the items
+        on each page.
+
+        Pages are requested by ``max_pages`` coroutines of their own,
+        rather than by the workers, so every worker is free to mine
+        items. Each page's identifiers are queued as soon as it arrives,
+        and the next page is only requested once they fit in the queue.
+        """
+        # The only field needed is "identifier".
+        params = dict((k, v) for k, v in (params or {}).items() if 'fl' not in k)
+        params['fl[]'] = 'identifier'
+        search_params = self.get_search_params(query, params)
+        url = self.make_url('/advancedsearch.php')
+
+        # Counted through the session, with retries, rather than with
+        # get_search_info(), which would block the loop.
+        total_results = yield from self.get_num_found(search_params['q'])
+        pages = iter(range(1, int(total_results/search_params['rows']) + 2))
+
+        @asyncio.coroutine
+        def page_through():
+            # The pages iterator is shared, so each page is only
+            # requested once.
+            for page in pages:
+                result = yield from self._fetch_json(url, dict(search_params, page=page))
+                if not result:
+                    continue
+                docs = result[0].get('response', {}).get('docs', [])
+                yield from self.queue_items(
+                        [d['identifier'] for d in docs if d.get('identifier')], callback)
+
+        yield from asyncio.gather(*[page_through() for _ in range(self.max_pages)],
+                                  loop=self.loop)
+
+    def search_requests(self, query=None, params=None, callback=None):
         """Mine Archive.org search results.
 
         :param query: The Archive.org search query to yield results for.
@@ -223,14 +731,6 @@ class SearchMiner(ItemMiner):
                        to the Archive.org Advancedsearch Api.
         :type params: dict
         """
-        # If mining ids, devote half the workers to search and half to item mining.
-        if mine_ids:
-            self.max_tasks = self.max_tasks/2
-        # When mining id's, the only field we need returned is "identifier".
-        if mine_ids and params:
-            params = dict((k, v) for k, v in params.items() if 'fl' not in k)
-            params['fl[]'] = 'identifier'
-
         # Make sure "identifier" is always returned in search results.
         fields = [k for k in params if 'fl' in k]
         if (len(fields) == 1) and (not any('identifier' == params[k] for k in params)):
@@ -241,58 +741,304 @@ class SearchMiner(ItemMiner):
             params['fl[{}]'.format(i)] = 'identifier'
 
         search_params = self.get_search_params(query, params)
-        url = make_url('/advancedsearch.php', self.protocol, self.hosts)
+        url = self.make_url('/advancedsearch.php')
 
         search_info = self.get_search_info(search_params)
         total_results = search_info.get('response', {}).get('numFound', 0)
         total_pages = (int(total_results/search_params['rows']) + 1)
 
+        # Sinks that store records by identifier get each search result
+        # as a record of its own, rather than whole pages.
+        split = search_results if self.sink.split_pages else None
+        context = self.request_context(sink=self.sink, callback=callback, split=split)
+        # Page numbers only mean the same results for the same query and
+        # parameters, so these are part of the pages' journal keys.
+        search_key = hashlib.sha1(json.dumps(sorted(
+                (k, v) for k, v in search_params.items() if k != 'page')).encode('utf-8'))
+        search_key = search_key.hexdigest()[:16]
         for page in range(1, (total_pages + 1)):
-            params = deepcopy(search_params)
-            params['page'] = page
-            if not callback and mine_ids:
-                callback = self._handle_search_results
-            req = MineRequest('GET', url, self.access,
-                              callback=callback,
-                              max_retries=self.max_retries,
-                              debug=self.debug,
-                              params=params,
-                              connector=self.connector)
-            yield req
+            key = 'page:{}:{}'.format(search_key, page)
+            if (self.journal is not None) and (key in self.journal):
+                continue
+            # The parameters are flat, so a shallow copy will do.
+            yield MineRequest('GET', url, context, key=key,
+                              params=dict(search_params, page=page))
+
+    def get_scrape_params(self, query, params, mine_ids=None):
+        """Translate Advancedsearch API parameters into parameters for
+        the scrape API.
+        """
+        params = params if params else {}
+        fields = [v for k, v in sorted(params.items()) if k.startswith('fl')]
+        if mine_ids or (fields and 'identifier' not in fields):
+            fields = ['identifier'] if mine_ids else fields + ['identifier']
+        if self.watermark and (self.watermark.field not in fields):
+            fields = (fields if fields else ['identifier']) + [self.watermark.field]
+        # The scrape API returns between 100 and 10,000 results per page.
+        count = min(max(int(params.get('rows', 10000)), 100), 10000)
+        scrape_params = {
+            'q': query if query else 'all:1',
+            'count': count,
+        }
+        if fields:
+            scrape_params['fields'] = ','.join(fields)
+        return scrape_params
 
     @asyncio.coroutine
-    def mine_items(self):
-        while True:
-            request = yield from self.iq.get()
-            yield from self.make_rate_limited_request(request)
-            self.iq.task_done()
+    def _fetch_json(self, url, params):
+        """Make a rate limited request, and return the decoded JSON and
+        the response, or ``None`` if the request failed.
+        """
+        result = []
+
+        @asyncio.coroutine
+        def read_json(resp):
+            result.append((yield from resp.json(encoding='utf-8')))
+            result.append(resp)
+
+        req = MineRequest('GET', url, self.request_context(callback=read_json),
+                          params=params)
+        handled = yield from self.make_rate_limited_request(req)
+        return result if handled else None
 
     @asyncio.coroutine
-    def search(self, query=None, params=None, callback=None, mine_ids=None):
-        search_requests = self.search_requests(query, params, callback, mine_ids)
-        if mine_ids:
-            workers = [asyncio.Task(self.mine_items(), loop=self.loop)
-                       for _ in range(self.max_tasks)]
+    def get_num_found(self, query):
+        """Get the number of results for a query.
+
+        :rtype: int
+        """
+        params = self.get_search_params(query, None)
+        params['rows'] = 0
+        url = self.make_url('/advancedsearch.php')
+        result = yield from self._fetch_json(url, params)
+        if not result:
+            return 0
+        return result[0].get('response', {}).get('numFound', 0)
+
+    @asyncio.coroutine
+    def partition_query(self, query, partitions):
+        """Split a query into disjoint sub-queries of similar size.
+
+        Identifiers are grouped by their first character, with one more
+        group for identifiers starting with any other character, so
+        together the groups match exactly what ``query`` does. The
+        number of results in each group is probed, and groups are packed
+        into at most ``partitions`` sub-queries, largest first.
+
+        :rtype: list
+        :returns: A list of sub-queries.
+        """
+        query = query if query else 'all:1'
+        clauses = ['identifier:{}*'.format(c) for c in IDENTIFIER_PREFIXES]
+        groups = ['({}) AND {}'.format(query, c) for c in clauses]
+        groups.append('({}) AND NOT ({})'.format(query, ' OR '.join(clauses)))
+        counts = yield from asyncio.gather(*[self.get_num_found(g) for g in groups],
+                                           loop=self.loop)
+
+        buckets = [[0, []] for _ in range(min(partitions, len(groups)))]
+        for count, group in sorted(zip(counts, groups), reverse=True):
+            if not count:
+                continue
+            bucket = min(buckets, key=lambda b: b[0])
+            bucket[0] += count
+            bucket[1].append(group)
+
+        return [' OR '.join('({})'.format(g) for g in b[1]) for b in buckets if b[1]]
 
-        yield from self.mine(search_requests)
-        # Wait a bit for all connections to close.
-        yield from asyncio.sleep(1)
+    def _unseen(self, docs):
+        if self._seen is None:
+            return docs
+        unseen = []
+        for doc in docs:
+            identifier = doc.get('identifier')
+            if identifier and (not self._seen.add(identifier)):
+                continue
+            unseen.append(doc)
+        return unseen
 
+    @asyncio.coroutine
+    def _handle_scrape_page(self, j, resp, callback=None, mine_ids=None):
+        if self.watermark:
+            for doc in j.get('items', []):
+                self.watermark.observe(doc)
         if mine_ids:
-            for w in workers:
-                w.cancel()
+            docs = self._unseen(j.get('items', []))
+            yield from self.queue_items(
+                    [d['identifier'] for d in docs if d.get('identifier')], callback)
+        elif callback and is_sync_callback(callback):
+            body = yield from resp.read()
+            # A page has no single key to write the result under, so
+            # keyed sinks take it from the result.
+            yield from self.callback_pool.submit(callback, body, resp.url,
+                                                 sink=self.sink, key=None)
+        elif callback:
+            yield from callback(resp)
+        else:
+            for doc in self._unseen(j.get('items', [])):
+                yield from self.sink.write(json.dumps(doc), key=doc.get('identifier'))
+
+    @asyncio.coroutine
+    def scrape(self, query=None, params=None, callback=None, mine_ids=None):
+        """Page through search results with the scrape API's cursor.
+
+        Unlike paging with ``page=N``, every page costs the same no matter
+        how deep into the results it is, and results don't drift if the
+        index changes during the run. The next page is requested as soon
+        as the current page's cursor is known, so it is in flight while
+        the current page is being handled.
+
+        Without a callback, each search result is written to the sink as
+        a separate record.
+        """
+        scrape_params = self.get_scrape_params(query, params, mine_ids)
+        url = self.make_url('/services/search/v1/scrape')
+
+        page = asyncio.Task(self._fetch_json(url, scrape_params), loop=self.loop)
+        while page:
+            result = yield from page
+            if not result:
+                break
+            j, resp = result
+            page = None
+            if j.get('cursor'):
+                p = dict(scrape_params, cursor=j['cursor'])
+                page = asyncio.Task(self._fetch_json(url, p), loop=self.loop)
+            yield from self._handle_scrape_page(j, resp, callback, mine_ids)
+
+    @asyncio.coroutine
+    def scrape_partitioned(self, query=None, params=None, callback=None, mine_ids=None,
+                           partitions=None):
+        """Split a query into ``partitions`` disjoint sub-queries, and
+        page through them concurrently with :meth:`scrape`.
+
+        Results are merged into one stream, and results seen in more than
+        one partition are dropped. A callback is called on every page of
+        every partition, so callers using a callback must handle
+        duplicates themselves.
+        """
+        queries = yield from self.partition_query(query, partitions)
+        self._seen = SpillingSet()
+        try:
+            yield from asyncio.gather(
+                    *[self.scrape(q, params, callback, mine_ids) for q in queries],
+                    loop=self.loop)
+        finally:
+            self._seen.close()
+            self._seen = None
+
+    def save_watermark(self):
+        """Save the watermark after a successful run. If any requests
+        were given up on, the old watermark is kept so the next run
+        covers their items again.
+        """
+        if self.metrics.give_ups:
+            sys.stderr.write('{}\n'.format(json.dumps(dict(
+                message='Requests failed, not updating the watermark.',
+                watermark=self.watermark.value))))
+            return
+        self.watermark.save()
+
+    @asyncio.coroutine
+    def search(self, query=None, params=None, callback=None, mine_ids=None,
+               journal=None, cursor=None, partitions=None, watermark=None):
+        if watermark and not isinstance(watermark, Watermark):
+            watermark = Watermark(watermark)
+        self.watermark = watermark if watermark else None
+        if self.watermark:
+            query = self.watermark.restrict(query)
+            # Search results are only read one by one when paging with
+            # the scrape API.
+            cursor = True
+        self.open_journal(journal)
+        try:
+            yield from self.start()
+            # Paging with cursors starts no workers, so metrics are
+            # reported from here.
+            self.start_background_tasks()
+            if mine_ids:
+                # Search pages are requested outside of the workers, so
+                # all of them are free to mine the items found.
+                workers = [asyncio.Task(self.work(), loop=self.loop)
+                           for _ in range(self.max_tasks)]
+
+            if partitions and partitions > 1:
+                yield from self.scrape_partitioned(query, params, callback, mine_ids,
+                                                   partitions)
+            elif cursor:
+                yield from self.scrape(query, params, callback, mine_ids)
+            elif mine_ids:
+                yield from self.search_ids(query, params, callback)
+            else:
+                yield from self.mine(self.search_requests(query, params, callback))
+                # Wait a bit for all connections to close.
+                yield from asyncio.sleep(1)
+            yield from self.join(self.q)
+            yield from self.callback_pool.join()
+            yield from self.sink.flush()
+
+            if mine_ids:
+                for w in workers:
+                    w.cancel()
+            if self.watermark:
+                self.save_watermark()
+        finally:
+            self.close()
+
+    def iter_search(self, query=None, params=None, mine_ids=None, journal=None,
+                    cursor=None, partitions=None, watermark=None, buffer_size=None):
+        """Mine Archive.org search results, or the items they match if
+        ``mine_ids`` is ``True``, and iterate over them as they are mined.
+        Takes the same arguments as :meth:`search`, apart from
+        ``callback``. Search results are yielded one by one, with or
+        without ``cursor``.
+
+        :param buffer_size: (optional) The number of records to buffer.
+                            Mining pauses while the buffer is full.
+        :type buffer_size: int
+
+        :rtype: :class:`iamine.records.Records`
+        """
+        self.use_queue_sink(buffer_size)
+        return Records(self.search(query, params, mine_ids=mine_ids, journal=journal,
+                                   cursor=cursor, partitions=partitions,
+                                   watermark=watermark),
+                       self.sink, loop=self.loop)
+
+
+# search_results() _______________________________________________________________________
+def search_results(page):
+    """Split a page of Advancedsearch API results into
+    ``(identifier, document)`` pairs.
+
+    :type page: dict
+
+    :rtype: list
+    """
+    docs = page.get('response', {}).get('docs', [])
+    return [(d.get('identifier'), d) for d in docs]
 
 
 # metadata_requests() ____________________________________________________________________
-def metadata_requests(identifiers, params=None, callback=None, miner=None):
-    protocol = None if not miner else miner.protocol
-    hosts = None if not miner else miner.hosts
-    urls = metadata_urls(identifiers, protocol, hosts)
-
-    for url in urls:
-        yield MineRequest('GET', url, miner.access,
-                          callback=callback,
-                          max_retries=miner.max_retries,
-                          debug=miner.debug,
-                          params=params,
-                          connector=miner.connector)
+def metadata_requests(identifiers, params=None, callback=None, miner=None,
+                      projection=None):
+    journal = None if not miner else miner.journal
+    dedupe = None if not miner else miner.dedupe
+    # Everything but the URL and identifier is shared by all requests.
+    context = miner.request_context(cache=miner.cache,
+                                    sink=miner.sink,
+                                    callback=callback,
+                                    projection=projection,
+                                    params=params)
+
+    for identifier in identifiers:
+        identifier = identifier.strip()
+        if (journal is not None) and (identifier in journal):
+            continue
+        if (dedupe is not None) and (not dedupe.add(identifier)):
+            miner.metrics.duplicates += 1
+            continue
+        if projection:
+            url = miner.make_url(projection.path(identifier))
+        else:
+            url = miner.make_url('/metadata/{}'.format(identifier))
+        yield MineRequest('GET', url, context, key=identifier)
@@ -0,0 +1,150 @@
+import os
+import math
+import sqlite3
+import hashlib
+import tempfile
+
+
+class SpillingSet(object):
+    """A set of keys that keeps at most ``max_items`` in memory, and
+    spills the rest to a temporary SQLite database.
+
+    Keys are stored as 8 byte hashes, as in :class:`iamine.journal.Journal`.
+
+    :param max_items: (optional) The number of keys to keep in memory
+                      before spilling them to disk. Defaults to 1,000,000.
+    :type max_items: int
+
+    :param directory: (optional) The directory to create the database
+                      in. Defaults to the system's temporary directory.
+    :type directory: str
+    """
+
+    def __init__(self, max_items=None, directory=None):
+        max_items = 1000000 if not max_items else max_items
+
+        self.max_items = max_items
+        self.directory = directory
+        self._memory = set()
+        self._db = None
+        self._path = None
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()[:8]
+        # SQLite integers are signed.
+        return int.from_bytes(digest, 'little', signed=True)
+
+    def add(self, key):
+        """Add a key to the set.
+
+        :rtype: bool
+        :returns: ``True`` if the key wasn't in the set already.
+        """
+        h = self._hash(key)
+        if h in self._memory:
+            return False
+        if self._db is not None:
+            if self._db.execute('SELECT 1 FROM seen WHERE h = ?', (h,)).fetchone():
+                return False
+        self._memory.add(h)
+        if len(self._memory) >= self.max_items:
+            self._spill()
+        return True
+
+    def _spill(self):
+        if self._db is None:
+            fd, self._path = tempfile.mkstemp(prefix='iamine-', suffix='.sqlite',
+                                              dir=self.directory)
+            os.close(fd)
+            self._db = sqlite3.connect(self._path)
+            # The database is thrown away when mining is done, so don't
+            # pay for durability.
+            self._db.execute('PRAGMA journal_mode = OFF')
+            self._db.execute('PRAGMA synchronous = OFF')
+            self._db.execute('CREATE TABLE seen (h INTEGER PRIMARY KEY)')
+        with self._db:
+            self._db.executemany('INSERT OR IGNORE INTO seen VALUES (?)',
+                                 ((h,) for h in sorted(self._memory)))
+        self._memory.clear()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self._path)
+
+
+class _BloomSlice(object):
+
+    def __init__(self, capacity, fpr):
+        self.capacity = capacity
+        self.bits = int(math.ceil(-capacity * math.log(fpr) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round((self.bits / capacity) * math.log(2))))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, h1, h2):
+        return [(h1 + (i * h2)) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, hashes):
+        a = self.array
+        return all(a[p >> 3] & (1 << (p & 7)) for p in self._positions(*hashes))
+
+    def add(self, hashes):
+        a = self.array
+        for p in self._positions(*hashes):
+            a[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+class BloomFilter(object):
+    """A scalable Bloom filter.
+
+    Memory grows with the number of keys added rather than being sized
+    up front: when a filter fills up, a new one twice its size is added,
+    with half its false positive rate, so the overall false positive
+    rate stays below ``fpr``. Ten million keys take about 36MB at the
+    default rate.
+
+    :param fpr: (optional) The false positive rate, i.e. the chance of a
+                new key being taken for one already added. Defaults to
+                0.001.
+    :type fpr: float
+
+    :param capacity: (optional) The number of keys the first filter
+                     holds. Defaults to 1,000,000.
+    :type capacity: int
+    """
+
+    def __init__(self, fpr=None, capacity=None):
+        fpr = 0.001 if not fpr else fpr
+        capacity = 1000000 if not capacity else capacity
+
+        self.fpr = fpr
+        self._slices = [_BloomSlice(capacity, fpr / 2.0)]
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        return (int.from_bytes(digest[:8], 'little'),
+                int.from_bytes(digest[8:16], 'little') | 1)
+
+    def add(self, key):
+        """Add a key to the filter.
+
+        :rtype: bool
+        :returns: ``True`` if the key wasn't in the filter already.
+        """
+        hashes = self._hash(key)
+        if any(hashes in s for s in self._slices):
+            return False
+        last = self._slices[-1]
+        if last.count >= last.capacity:
+            last = _BloomSlice(last.capacity * 2, self.fpr / (2.0 ** (len(self._slices) + 1)))
+            self._slices.append(last)
+        last.add(hashes)
+        return True
+
+    def close(self):
+        pass
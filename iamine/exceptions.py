@@ -1,3 +1,21 @@
 class AuthenticationError(Exception):
     """Exception raised when authentication failed for some reason."""
     pass
+
+
+class MiningError(Exception):
+    """Exception raised when a mining process fails without an
+    exception of its own to pass on, e.g. when it is killed."""
+    pass
+
+
+class SinkError(Exception):
+    """Exception raised when a sink fails to write records. Mining
+    stops, as anything mined after it would be lost too."""
+    pass
+
+
+class HTTPError(Exception):
+    """Exception raised when a request gets a 429 or 5xx response, which
+    is retried."""
+    pass
@@ -0,0 +1,137 @@
+import time
+
+
+class Host(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.outstanding = 0
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.backoff = 0
+        self.ejected_until = None
+        self.probing = False
+
+    def score(self):
+        # Hosts with no latency yet are tried first.
+        latency = self.latency if self.latency is not None else 0.0
+        return (self.outstanding + 1) * latency, self.outstanding
+
+
+class HostPool(object):
+    """Pick a host for each request as it is made.
+
+    The host with the fewest requests outstanding, weighted by its
+    smoothed latency, is picked, so slow hosts get less traffic. A host
+    that fails ``failure_threshold`` times in a row is taken out of
+    rotation for ``eject_time`` seconds, doubling each time it is ejected
+    again. Once that time has passed a single probe request is sent to
+    it, and it's put back into rotation if the probe succeeds.
+
+    :param hosts: The hosts to pick from.
+    :type hosts: list
+
+    :param failure_threshold: (optional) Defaults to 5.
+    :type failure_threshold: int
+
+    :param eject_time: (optional) Defaults to 10 seconds.
+    :type eject_time: float
+
+    :param max_eject_time: (optional) Defaults to 300 seconds.
+    :type max_eject_time: float
+    """
+
+    def __init__(self, hosts, failure_threshold=None, eject_time=None,
+                 max_eject_time=None):
+        failure_threshold = 5 if not failure_threshold else failure_threshold
+        eject_time = 10.0 if not eject_time else eject_time
+        max_eject_time = 300.0 if not max_eject_time else max_eject_time
+
+        self.failure_threshold = failure_threshold
+        self.eject_time = eject_time
+        self.max_eject_time = max_eject_time
+        self.hosts = dict((h, Host(h)) for h in hosts)
+
+    def __contains__(self, name):
+        return name in self.hosts
+
+    def acquire(self):
+        """Pick a host, and count a request as outstanding on it.
+
+        :rtype: str
+        """
+        now = time.monotonic()
+        candidates = []
+        for host in self.hosts.values():
+            if host.ejected_until is None:
+                candidates.append(host)
+            elif (not host.probing) and (now >= host.ejected_until):
+                # Probe ejected hosts as soon as they're due.
+                host.probing = True
+                candidates = [host]
+                break
+        if not candidates:
+            # Everything is ejected, use whichever host is due back first
+            # rather than stalling.
+            candidates = [min(self.hosts.values(), key=lambda h: h.ejected_until)]
+        host = min(candidates, key=Host.score)
+        host.outstanding += 1
+        return host.name
+
+    def release(self, name):
+        host = self.hosts[name]
+        host.outstanding -= 1
+        # A probe that didn't reach the host (e.g. it was answered from
+        # the cache) is retried by the next request.
+        host.probing = False
+
+    def record(self, name, status, latency):
+        """Record the outcome of a request to a host.
+
+        :param status: The response's status code, or ``None`` if no
+                       response was received.
+        :type status: int
+        """
+        host = self.hosts[name]
+        host.requests += 1
+        # A 429 is the global rate limit, not a sign of an unhealthy host.
+        if (status is None) or (status >= 500):
+            host.failures += 1
+            host.consecutive_failures += 1
+            if host.probing or ((host.ejected_until is None)
+                                and (host.consecutive_failures >= self.failure_threshold)):
+                self._eject(host)
+            return
+        host.latency = latency if host.latency is None else \
+            (0.8 * host.latency) + (0.2 * latency)
+        host.consecutive_failures = 0
+        if host.probing:
+            host.ejected_until = None
+            host.probing = False
+            host.backoff = 0
+
+    def _eject(self, host):
+        eject_time = min(self.max_eject_time, self.eject_time * (2 ** host.backoff))
+        host.ejections += 1
+        host.backoff += 1
+        host.ejected_until = time.monotonic() + eject_time
+        host.probing = False
+        host.consecutive_failures = 0
+
+    def stats(self):
+        """Get each host's requests, failures, outstanding requests,
+        smoothed latency and whether it's in rotation.
+
+        :rtype: dict
+        """
+        return dict((h.name, dict(
+            requests=h.requests,
+            failures=h.failures,
+            outstanding=h.outstanding,
+            latency=round(h.latency, 4) if h.latency is not None else None,
+            ejections=h.ejections,
+            ejected=h.ejected_until is not None,
+        )) for h in self.hosts.values())
@@ -0,0 +1,148 @@
+import os
+import sys
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+
+
+def _digest(key):
+    return hashlib.sha1(key.encode('utf-8')).digest()[:8]
+
+
+# The journal starts with the number of hashes in its sorted region.
+HEADER = struct.Struct('<Q')
+
+
+class Journal(object):
+    """An append-only journal of completed work, used to resume
+    interrupted runs.
+
+    Keys (item identifiers, or ``page:...`` keys for finished search
+    pages) are stored as 8 byte hashes, so the journal for a 40M item
+    job is about 320MB on disk. Hashes are kept sorted in an array, and
+    looked up by binary search, so they take as little memory as they
+    do on disk and load in about the time it takes to read the file.
+
+    Keys added during a run are appended to the journal, and kept in a
+    set. When the journal is next opened, they are merged into the
+    sorted hashes, which takes a few microseconds per key. A record cut
+    short by a crash is dropped then. Several processes can add keys to
+    the same journal, but only one may open it while it has keys to
+    merge.
+
+    :param path: The journal file. It is created if it does not exist.
+    :type path: str
+
+    :param flush_every: (optional) Flush the journal to disk after this
+                        many keys have been added. Defaults to 1000.
+    :type flush_every: int
+    """
+
+    record_size = 8
+
+    def __init__(self, path, flush_every=None):
+        flush_every = 1000 if not flush_every else flush_every
+
+        self.path = path
+        self.flush_every = flush_every
+        self._sorted = self._load(path)
+        self._added = set()
+        self._fh = open(path, 'ab')
+        self._unflushed = 0
+
+    def _load(self, path):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < HEADER.size:
+            with open(path, 'wb') as fh:
+                fh.write(HEADER.pack(0))
+            return array('Q')
+        complete = size - (size % self.record_size)
+        if complete != size:
+            os.truncate(path, complete)
+        with open(path, 'rb') as fh:
+            n = HEADER.unpack(fh.read(HEADER.size))[0]
+            hashes = array('Q')
+            hashes.frombytes(fh.read(n * self.record_size))
+            tail = array('Q')
+            tail.frombytes(fh.read())
+        if tail:
+            hashes = self._merge(path, hashes, tail)
+        return hashes
+
+    def _merge(self, path, hashes, tail):
+        """Merge the hashes appended to the journal into its sorted
+        region, by rewriting it. The sorted hashes are copied in slices
+        between the new ones, rather than sorted again.
+        """
+        tmp = '{}.tmp'.format(path)
+        view = memoryview(hashes).cast('B')
+        size = self.record_size
+        out = array('Q')
+        n = len(hashes)
+        with open(tmp, 'wb') as fh:
+            fh.write(HEADER.pack(0))
+            start = 0
+            for h in sorted(set(tail)):
+                i = bisect_left(hashes, h)
+                if (i != len(hashes)) and (hashes[i] == h):
+                    continue
+                out.frombytes(view[start * size:i * size])
+                out.append(h)
+                start = i
+                n += 1
+                if len(out) >= 65536:
+                    fh.write(out)
+                    del out[:]
+            fh.write(out)
+            fh.write(view[start * size:])
+            fh.seek(0)
+            fh.write(HEADER.pack(n))
+        view.release()
+        os.replace(tmp, path)
+        # Free the old hashes before reading the new ones.
+        del hashes[:]
+        with open(path, 'rb') as fh:
+            fh.seek(HEADER.size)
+            merged = array('Q')
+            merged.frombytes(fh.read())
+        return merged
+
+    def _contains(self, h):
+        if h in self._added:
+            return True
+        i = bisect_left(self._sorted, h)
+        return (i != len(self._sorted)) and (self._sorted[i] == h)
+
+    def __contains__(self, key):
+        return self._contains(int.from_bytes(_digest(key), sys.byteorder))
+
+    def __len__(self):
+        return len(self._sorted) + len(self._added)
+
+    def add(self, key):
+        """Record ``key`` as completed.
+
+        :param key: An item identifier or search page key.
+        :type key: str
+        """
+        digest = _digest(key)
+        h = int.from_bytes(digest, sys.byteorder)
+        if self._contains(h):
+            return
+        self._added.add(h)
+        self._fh.write(digest)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._fh.flush()
+        self._unflushed = 0
+
+    def close(self):
+        if self._fh.closed:
+            return
+        self.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
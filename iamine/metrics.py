@@ -0,0 +1,191 @@
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+
+def endpoint_name(url):
+    """Get a short name for the Archive.org API a URL belongs to, e.g.
+    ``metadata``, ``advancedsearch`` or ``scrape``.
+
+    :rtype: str
+    """
+    parts = [p for p in urlsplit(url).path.split('/') if p]
+    if not parts:
+        return '/'
+    name = parts[-1] if parts[0] == 'services' else parts[0]
+    return name[:-len('.php')] if name.endswith('.php') else name
+
+
+class Histogram(object):
+    """A histogram with fixed bucket bounds, in seconds."""
+
+    bounds = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        """Get the upper bound of the bucket the ``p`` th percentile
+        falls in.
+
+        :rtype: float
+        """
+        if not self.count:
+            return None
+        rank = self.count * (p / 100.0)
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics(object):
+    """Counters and latency histograms for a mining run.
+
+    :param gauges: (optional) A callable returning a dict of current
+                   values, such as queue depths and active requests.
+    :type gauges: func
+
+    :param hosts: (optional) The :class:`iamine.hosts.HostPool` requests
+                  are balanced over, to report the state of each host.
+    """
+
+    def __init__(self, gauges=None, hosts=None):
+        self.gauges = gauges
+        self.hosts = hosts
+        self.started = time.monotonic()
+        self.requests = defaultdict(int)
+        self.statuses = defaultdict(int)
+        self.errors = 0
+        self.retries = 0
+        self.give_ups = 0
+        self.duplicates = 0
+        self.bytes_received = 0
+        self.latency = Histogram()
+        self.endpoint_latency = defaultdict(Histogram)
+        self.host_latency = defaultdict(Histogram)
+        self._last_report = (self.started, 0)
+
+    def record(self, url, status, latency, size=None):
+        """Record an attempted request.
+
+        :param status: The response's status code, or ``None`` if no
+                       response was received.
+        :type status: int
+        """
+        endpoint = endpoint_name(url)
+        self.requests[endpoint] += 1
+        if status is None:
+            self.errors += 1
+        else:
+            self.statuses[status] += 1
+        self.bytes_received += size if size else 0
+        self.latency.observe(latency)
+        self.endpoint_latency[endpoint].observe(latency)
+        self.host_latency[urlsplit(url).netloc].observe(latency)
+
+    def report(self):
+        """Get a summary of the run so far, including the request rate
+        since the last report.
+
+        :rtype: dict
+        """
+        now = time.monotonic()
+        total = sum(self.requests.values())
+        last_time, last_total = self._last_report
+        self._last_report = (now, total)
+        stats = dict(
+            elapsed=round(now - self.started, 1),
+            requests=total,
+            requests_per_second=round((total - last_total) / max(now - last_time, 1e-9), 1),
+            errors=self.errors,
+            retries=self.retries,
+            give_ups=self.give_ups,
+            duplicates=self.duplicates,
+            bytes_received=self.bytes_received,
+            latency_p50=self.latency.percentile(50),
+            latency_p99=self.latency.percentile(99),
+            endpoints=dict((k, dict(p50=h.percentile(50), p99=h.percentile(99), count=h.count))
+                           for k, h in self.endpoint_latency.items()),
+        )
+        if self.hosts:
+            stats['hosts'] = self.hosts.stats()
+        if self.gauges:
+            stats.update(self.gauges())
+        return stats
+
+    def prometheus(self):
+        """Render the metrics in the Prometheus text exposition format.
+
+        :rtype: str
+        """
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append('# HELP iamine_{} {}'.format(name, help))
+            lines.append('# TYPE iamine_{} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('iamine_{}{} {}'.format(name, labels, value))
+
+        def histogram(name, label, histograms):
+            samples = []
+            for key, h in sorted(histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.bounds + ('+Inf',), h.counts):
+                    cumulative += count
+                    samples.append(('_bucket{{{}="{}",le="{}"}}'.format(label, key, bound),
+                                    cumulative))
+                samples.append(('_sum{{{}="{}"}}'.format(label, key), h.sum))
+                samples.append(('_count{{{}="{}"}}'.format(label, key), h.count))
+            metric(name, 'histogram', 'Request latency in seconds by {}.'.format(label),
+                   samples)
+
+        metric('requests_total', 'counter', 'Requests attempted.',
+               [('{{endpoint="{}"}}'.format(k), v) for k, v in sorted(self.requests.items())])
+        metric('responses_total', 'counter', 'Responses received by status code.',
+               [('{{status="{}"}}'.format(k), v) for k, v in sorted(self.statuses.items())])
+        metric('errors_total', 'counter', 'Requests that got no response.',
+               [('', self.errors)])
+        metric('retries_total', 'counter', 'Requests scheduled for a retry.',
+               [('', self.retries)])
+        metric('give_ups_total', 'counter', 'Requests given up on after all retries failed.',
+               [('', self.give_ups)])
+        metric('duplicates_total', 'counter', 'Duplicate identifiers skipped.',
+               [('', self.duplicates)])
+        metric('received_bytes_total', 'counter', 'Response body bytes received.',
+               [('', self.bytes_received)])
+        histogram('endpoint_latency_seconds', 'endpoint', self.endpoint_latency)
+        histogram('host_latency_seconds', 'host', self.host_latency)
+        if self.hosts:
+            hosts = sorted(self.hosts.stats().items())
+            metric('host_outstanding_requests', 'gauge', 'Requests in flight to each host.',
+                   [('{{host="{}"}}'.format(k), v['outstanding']) for k, v in hosts])
+            metric('host_ejected', 'gauge', 'Whether each host is out of rotation.',
+                   [('{{host="{}"}}'.format(k), int(v['ejected'])) for k, v in hosts])
+            metric('host_ejections_total', 'counter',
+                   'Times each host was taken out of rotation.',
+                   [('{{host="{}"}}'.format(k), v['ejections']) for k, v in hosts])
+        if self.gauges:
+            for name, value in sorted(self.gauges().items()):
+                if value is not None:
+                    metric(name, 'gauge', 'Current value of {}.'.format(name), [('', value)])
+        lines.append('')
+        return '\n'.join(lines)
+
+    def write_prometheus(self, path):
+        """Atomically write the metrics to a Prometheus textfile."""
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'w') as fh:
+            fh.write(self.prometheus())
+        os.replace(tmp, path)
@@ -0,0 +1,150 @@
+import os
+import sys
+import pickle
+import asyncio
+import multiprocessing
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from .core import ItemMiner
+from .journal import Journal
+from .sinks import StreamSink
+from .exceptions import MiningError
+
+
+def shard_offsets(path, shards):
+    """Split a file into byte ranges of roughly equal size, without
+    reading it.
+
+    :param path: The file to split.
+    :type path: str
+
+    :param shards: The number of ranges to split the file into.
+    :type shards: int
+
+    :rtype: list
+    :returns: A list of ``(start, end)`` byte offsets.
+    """
+    size = os.path.getsize(path)
+    bounds = [(size * i) // shards for i in range(shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_shard(path, start, end):
+    """Yield the lines of a file that start within a byte range.
+
+    Each line belongs to exactly one range, so reading every range
+    returned by :func:`shard_offsets` yields every line once.
+
+    :param path: The file to read.
+    :type path: str
+
+    :param start: The offset of the first byte in the range.
+    :type start: int
+
+    :param end: The offset of the first byte after the range.
+    :type end: int
+    """
+    with open(path, 'rb') as fh:
+        if start > 0:
+            # Skip the line that started in the previous range.
+            fh.seek(start - 1)
+            fh.readline()
+        while fh.tell() < end:
+            line = fh.readline()
+            if not line:
+                break
+            yield line.decode('utf-8')
+
+
+def _mine_shard(path, start, end, shard, shards, lock, errors, params, callback, journal,
+                fields, kwargs):
+    try:
+        _run_shard(path, start, end, shard, shards, lock, params, callback, journal,
+                   fields, kwargs)
+    except Exception as exc:
+        # Pass the exception on to the parent, to be raised there.
+        try:
+            pickle.loads(pickle.dumps(exc))
+        except Exception:
+            exc = MiningError(repr(exc))
+        errors.put((shard, exc))
+        sys.exit(1)
+
+
+def _run_shard(path, start, end, shard, shards, lock, params, callback, journal,
+               fields, kwargs):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    sink = kwargs.pop('sink', None)
+    sink = sink.for_shard(shard, lock) if sink else StreamSink(lock=lock, loop=loop)
+    if kwargs.get('metrics_file'):
+        # One metrics file per shard, e.g. iamine-s000.prom.
+        name, ext = os.path.splitext(kwargs['metrics_file'])
+        kwargs['metrics_file'] = '{}-s{:03d}{}'.format(name, shard, ext)
+    miner = ItemMiner(loop=loop, sink=sink, rate_share=(1.0 / shards), **kwargs)
+    loop.run_until_complete(
+            miner.mine_items(read_shard(path, start, end), params, callback,
+                             journal=journal, fields=fields))
+
+
+def mine_items_in_processes(path, processes, params=None, callback=None, journal=None,
+                            fields=None, **kwargs):
+    """Mine an itemlist with one :class:`ItemMiner` per process.
+
+    The itemlist is split into byte ranges, one per process. Each
+    process gets an equal share of the global rate limit. Output written
+    to stdout is merged into one stream. A :class:`iamine.sinks.FileSink`
+    writes one file per process, as does ``metrics_file``.
+
+    :param path: The itemlist. It must be a regular file.
+    :type path: str
+
+    :param processes: The number of processes to use.
+    :type processes: int
+
+    :param \\*\\*kwargs: (optional) Arguments that :class:`ItemMiner` takes.
+
+    :raises: The exception a failed process raised, e.g.
+             :class:`iamine.exceptions.AuthenticationError`, or
+             :class:`iamine.exceptions.MiningError` if it had none, once
+             every process has finished. Every failure is logged to
+             stderr.
+    """
+    if journal:
+        # Opening the journal merges the keys added by the last run, which
+        # is done here so the processes don't all try to at once.
+        Journal(journal).close()
+    lock = multiprocessing.Lock()
+    # Exceptions are small, so they never fill the pipe and block the
+    # processes from exiting before they are read.
+    errors = multiprocessing.SimpleQueue()
+    workers = []
+    for shard, (start, end) in enumerate(shard_offsets(path, processes)):
+        p = multiprocessing.Process(
+                target=_mine_shard,
+                args=(path, start, end, shard, processes, lock, errors, params, callback,
+                      journal, fields, kwargs))
+        p.start()
+        workers.append(p)
+    for p in workers:
+        p.join()
+
+    failures = dict()
+    while not errors.empty():
+        shard, exc = errors.get()
+        failures[shard] = exc
+    for shard, p in enumerate(workers):
+        if p.exitcode and (shard not in failures):
+            failures[shard] = MiningError(
+                    'Mining process exited with code {}.'.format(p.exitcode))
+    for shard in sorted(failures):
+        sys.stderr.write('{}\n'.format(json.dumps(dict(
+            message='Mining process failed.',
+            shard=shard,
+            exception=repr(failures[shard]),
+        ))))
+    if failures:
+        raise failures[min(failures)]
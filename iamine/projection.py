@@ -0,0 +1,126 @@
+_MISSING = object()
+
+
+def parse_field(field):
+    """Split a field into the keys leading to it. ``[]`` after a key
+    selects every element of a list, e.g. ``files[].name``.
+
+    :rtype: tuple
+    """
+    keys = []
+    for key in field.strip().split('.'):
+        if key.endswith('[]'):
+            keys.extend([key[:-2], '[]'])
+        else:
+            keys.append(key)
+    return tuple(k for k in keys if k)
+
+
+def get_field(value, keys):
+    """Get the value of a field, parsed with :func:`parse_field`.
+
+    :returns: The value, a list of values for fields with ``[]``, or
+              ``None`` if the field is missing.
+    """
+    for i, key in enumerate(keys):
+        if key == '[]':
+            if not isinstance(value, list):
+                return None
+            values = (get_field(v, keys[i + 1:]) for v in value)
+            return [v for v in values if v is not None]
+        if (not isinstance(value, dict)) or (key not in value):
+            return None
+        value = value[key]
+    return value
+
+
+def _extract(value, keys):
+    if not keys:
+        return value
+    key, rest = keys[0], keys[1:]
+    if key == '[]':
+        if not isinstance(value, list):
+            return _MISSING
+        # Keep every element, so lists projected by several fields line
+        # up when they're merged.
+        elements = [_extract(v, rest) for v in value]
+        return [{} if v is _MISSING else v for v in elements]
+    if (not isinstance(value, dict)) or (key not in value):
+        return _MISSING
+    child = _extract(value[key], rest)
+    return _MISSING if child is _MISSING else {key: child}
+
+
+def _merge(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k, v in b.items():
+            a[k] = _merge(a[k], v) if k in a else v
+        return a
+    if isinstance(a, list) and isinstance(b, list) and (len(a) == len(b)):
+        return [_merge(x, y) for x, y in zip(a, b)]
+    return b
+
+
+class Projection(object):
+    """Select fields from item metadata.
+
+    The metadata API can return part of an item, e.g.
+    ``/metadata/{identifier}/metadata/title``. The longest path shared by
+    all fields is requested from the server, and the rest of each field
+    is selected from the response, so only the part of the item that's
+    needed is transferred.
+
+    :param fields: Dotted paths into the metadata, e.g.
+                   ``metadata.title`` or ``files[].name``.
+    :type fields: list
+    """
+
+    def __init__(self, fields):
+        self.fields = [parse_field(f) for f in fields]
+        prefix = []
+        for keys in zip(*self.fields):
+            if (keys[0] == '[]') or (len(set(keys)) > 1):
+                break
+            prefix.append(keys[0])
+        self.prefix = tuple(prefix)
+        self.relative = [keys[len(prefix):] for keys in self.fields]
+
+    def path(self, identifier):
+        """Get the metadata API path to request for an item.
+
+        :rtype: str
+        """
+        return '/'.join(('/metadata', identifier) + self.prefix)
+
+    def project(self, identifier, j):
+        """Select the fields from a metadata API response.
+
+        :param identifier: The item's identifier.
+        :type identifier: str
+
+        :param j: The decoded response to :meth:`path`.
+        :type j: dict
+
+        :rtype: dict
+        :returns: The selected fields, nested as they are in the item,
+                  and the item's identifier.
+        """
+        if self.prefix:
+            # Sub-path responses look like ``{"result": ...}``, or ``{}``
+            # if there's nothing at the path.
+            if 'result' not in j:
+                return dict(identifier=identifier)
+            j = j['result']
+        projected = _MISSING
+        for keys in self.relative:
+            value = _extract(j, keys)
+            if value is _MISSING:
+                continue
+            projected = value if projected is _MISSING else _merge(projected, value)
+        if projected is _MISSING:
+            return dict(identifier=identifier)
+        for key in reversed(self.prefix):
+            projected = {key: projected}
+        if isinstance(projected, dict):
+            projected.setdefault('identifier', identifier)
+        return projected
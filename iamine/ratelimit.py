@@ -0,0 +1,94 @@
+import asyncio
+
+
+class TokenBucket(object):
+    """An asyncio token bucket shared by all of a :class:`Miner`'s workers.
+
+    Tokens are added at ``rate`` per second, up to ``burst`` tokens, so
+    short bursts are allowed while the long-run rate never exceeds
+    ``rate``. A caller that finds the bucket empty reserves the next
+    token and sleeps until it is due. Waiters are therefore served in
+    order, and the event loop is never blocked.
+
+    :param rate: The number of tokens added per second.
+    :type rate: int
+
+    :param burst: (optional) The maximum number of tokens the bucket can
+                  hold. Defaults to a tenth of a second's worth of tokens.
+    :type burst: int
+
+    :param loop: (optional) The event loop to use.
+
+    :param refresh: (optional) A callable returning a new rate. It is
+                    called in the loop's default executor every
+                    ``refresh_interval`` seconds while the bucket is in use.
+    :type refresh: func
+
+    :param refresh_interval: (optional) Seconds between calls to
+                             ``refresh``. Defaults to 300.
+    :type refresh_interval: int
+    """
+
+    def __init__(self, rate, burst=None, loop=None, refresh=None,
+                 refresh_interval=None):
+        loop = asyncio.get_event_loop() if not loop else loop
+        refresh_interval = 300 if not refresh_interval else refresh_interval
+
+        self.loop = loop
+        self.refresh = refresh
+        self.refresh_interval = refresh_interval
+        self._burst = burst
+        self.set_rate(rate)
+
+        self._tokens = self.capacity
+        self._last = loop.time()
+        self._last_refresh = self._last
+        self._refreshing = None
+
+    def set_rate(self, rate):
+        """Change the fill rate of the bucket.
+
+        :param rate: The number of tokens added per second.
+        :type rate: int
+        """
+        self.rate = float(rate)
+        if self._burst:
+            self.capacity = float(self._burst)
+        else:
+            self.capacity = max(1.0, self.rate / 10.0)
+
+    def _fill(self):
+        now = self.loop.time()
+        self._tokens = min(self.capacity,
+                           self._tokens + ((now - self._last) * self.rate))
+        self._last = now
+        return now
+
+    def _maybe_refresh(self, now):
+        if (not self.refresh) or self._refreshing:
+            return
+        if (now - self._last_refresh) < self.refresh_interval:
+            return
+        self._last_refresh = now
+        self._refreshing = self.loop.run_in_executor(None, self.refresh)
+        self._refreshing.add_done_callback(self._refreshed)
+
+    def _refreshed(self, future):
+        self._refreshing = None
+        # Keep the current rate if the lookup failed.
+        if future.cancelled() or future.exception():
+            return
+        rate = future.result()
+        if rate and rate > 0:
+            self.set_rate(rate)
+
+    @asyncio.coroutine
+    def acquire(self):
+        """Take a token from the bucket, waiting until one is available."""
+        now = self._fill()
+        self._maybe_refresh(now)
+        # Tokens may go negative; the deficit is the queue of callers
+        # that have already reserved a future token.
+        self._tokens -= 1
+        if self._tokens < 0:
+            yield from asyncio.sleep(-self._tokens / self.rate, loop=self.loop)
@@ -0,0 +1,105 @@
+import asyncio
+
+from .requests import loads
+
+
+_DONE = object()
+
+
+def parse_record(record):
+    """Decode a record written to a sink.
+
+    :type record: str or bytes
+
+    :rtype: dict
+    """
+    return loads(record.encode('utf-8') if isinstance(record, str) else record)
+
+
+class Records(object):
+    """Iterate over the records a mining coroutine outputs, as they are
+    mined.
+
+    Records are read from a :class:`iamine.sinks.QueueSink`, decoded.
+    Mining starts when the first record is requested, and pauses while
+    the sink's queue is full, so it never gets far ahead of the
+    consumer.
+
+    Use ``async for`` from a coroutine running on the miner's loop::
+
+        records = miner.iter_items(identifiers)
+        async for record in records:
+            ...
+
+    Or iterate over it with ``for`` outside of the event loop, in which
+    case the loop runs only while the next record is being waited for.
+
+    :param mine: The mining coroutine, e.g. ``miner.mine_items(...)``.
+                 Its miner must write to ``sink``.
+
+    :param sink: The sink ``mine`` writes to.
+    :type sink: :class:`iamine.sinks.QueueSink`
+    """
+
+    def __init__(self, mine, sink, loop=None):
+        loop = asyncio.get_event_loop() if not loop else loop
+
+        self.loop = loop
+        self.sink = sink
+        self._mine = mine
+        self._task = None
+        self._exc = None
+
+    @asyncio.coroutine
+    def _run(self):
+        try:
+            yield from self._mine
+        except Exception as exc:
+            self._exc = exc
+        finally:
+            yield from self.sink.queue.put(_DONE)
+
+    @asyncio.coroutine
+    def next(self):
+        """Get the next record.
+
+        :rtype: dict
+        :returns: The next record, or ``None`` when mining is done.
+        :raises: Any exception raised while mining, once the records
+                 before it have been read.
+        """
+        if self._task is None:
+            self._task = asyncio.Task(self._run(), loop=self.loop)
+        record = yield from self.sink.queue.get()
+        if record is _DONE:
+            # Keep returning None if called again.
+            self.sink.queue.put_nowait(_DONE)
+            if self._exc is not None:
+                exc, self._exc = self._exc, None
+                raise exc
+            return None
+        return parse_record(record)
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        record = yield from self.next()
+        if record is None:
+            raise StopAsyncIteration
+        return record
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = self.loop.run_until_complete(self.next())
+        if record is None:
+            raise StopIteration
+        return record
+
+    def close(self):
+        """Stop mining, if it hasn't finished."""
+        if (self._task is not None) and (not self._task.done()):
+            self._task.cancel()
@@ -1,87 +1,403 @@
 import os
 import locale
 import sys
+import time
+import random
 import asyncio
 try:
     import ujson as json
 except ImportError:
     import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# ujson accepts unescaped control characters in strings, so the standard
+# library's parser is used where output must be checked strictly.
+import json as strict_json
 import traceback
+from functools import lru_cache, partial
+from email.utils import parsedate_to_datetime
 
 import aiohttp
 
 from . import __version__
+from .cache import CachedResponse
+from .callbacks import is_sync_callback
+from .exceptions import HTTPError, SinkError
 
 
-class MineRequest(object):
+@lru_cache()
+def get_user_agent_string(access_key):
+    uname = os.uname()
+    try:
+        lang = locale.getlocale()[0][:2]
+    except:
+        lang = ''
+    py_version = '{0}.{1}.{2}'.format(*sys.version_info)
+    return 'ia-mine/{0} ({1} {2}; N; {3}; {4}) Python/{5}'.format(
+        __version__, uname.sysname, uname.machine, lang, access_key, py_version)
+
+
+class RequestContext(object):
+    """Settings shared by many requests, e.g. every metadata request of
+    a run, so that each :class:`MineRequest` only keeps what is
+    particular to it. Headers, including the User-Agent, are built once
+    here rather than for every request.
+
+    :param access_key: The Archive.org access key, sent in the
+                       User-Agent.
+    :type access_key: str
+
+    :param projection: (optional) A :class:`iamine.projection.Projection`
+                       to select fields from each response with. Each
+                       request's key must be its item's identifier.
+
+    :param journal: (optional) A :class:`iamine.journal.Journal` to add
+                    each handled request's key to, once its records
+                    have been written out.
+
+    :param split: (optional) A function to split each decoded response
+                  into ``(key, document)`` pairs, written as separate
+                  records, e.g. search results from a page of them.
+                  Requests keep their own key for journaling.
+    """
 
-    def __init__(self, method, url, access_key, *,
+    __slots__ = ('session', 'cache', 'sink', 'journal', 'observer', 'callback', 'sync_callback',
+                 'callback_pool', 'projection', 'split', 'max_retries', 'debug', 'params',
+                 'request_kwargs')
+
+    def __init__(self, access_key, *,
+                 session=None,
+                 cache=None,
+                 sink=None,
+                 journal=None,
+                 observer=None,
                  callback=None,
+                 callback_pool=None,
+                 projection=None,
+                 split=None,
                  max_retries=None,
                  debug=None,
+                 params=None,
+                 headers=None,
                  **kwargs):
 
         max_retries = 10 if not max_retries else max_retries
+        headers = dict((k, v) for k, v in (headers or {}).items() if k.lower() != 'user-agent')
+        headers['User-agent'] = get_user_agent_string(access_key)
 
-        self.method = method
-        self.url = url
+        self.session = session
+        self.cache = cache
+        self.sink = sink
+        self.journal = journal
+        self.observer = observer
         self.callback = callback
+        self.sync_callback = (callback is not None) and is_sync_callback(callback)
+        self.callback_pool = callback_pool
+        self.projection = projection
+        self.split = split
         self.max_retries = max_retries
         self.debug = debug
+        self.params = params
+        kwargs['headers'] = headers
         self.request_kwargs = kwargs
-        self.access_key = access_key
 
-        self._headers = kwargs.get('headers', {})
-        self._user_agent = self._get_user_agent_string()
+
+class MineRequest(object):
+    """A request to make, and retry until it succeeds or runs out of
+    retries.
+
+    Requests are queued by the million, so they are slotted, and keep
+    anything that isn't particular to them in a shared
+    :class:`RequestContext`.
+
+    :param context: The shared context, or an access key to make a new
+                    one with from ``kwargs``.
+    :type context: :class:`RequestContext` or str
+
+    :param key: (optional) The key to journal the request and write its
+                record under, e.g. an item identifier.
+    :type key: str
+
+    :param params: (optional) URL parameters for this request, instead of
+                   the context's.
+    :type params: dict
+    """
+
+    __slots__ = ('method', 'url', 'key', 'context', 'params', 'retries', 'retry_after')
+
+    def __init__(self, method, url, context, *, key=None, params=None, **kwargs):
+        if not isinstance(context, RequestContext):
+            context = RequestContext(context, **kwargs)
+
+        self.method = method
+        self.url = url
+        self.key = key
+        self.context = context
+        self.params = context.params if params is None else params
+        self.retries = 0
+        self.retry_after = None
 
     @property
-    def headers(self):
-        headers = dict((k, v) for k, v in self._headers if k.lower() != 'user-agent')
-        headers['User-agent'] = self._user_agent
-        return headers
+    def max_retries(self):
+        return self.context.max_retries
 
-    def _get_user_agent_string(self):
-        uname = os.uname()
-        try:
-            lang = locale.getlocale()[0][:2]
-        except:
-            lang = ''
-        py_version = '{0}.{1}.{2}'.format(*sys.version_info)
-        return 'ia-mine/{0} ({1} {2}; N; {3}; {4}) Python/{5}'.format(
-            __version__, uname.sysname, uname.machine, lang, self.access_key, py_version)
+    @property
+    def request_kwargs(self):
+        kwargs = self.context.request_kwargs
+        if self.params is None:
+            return kwargs
+        return dict(kwargs, params=self.params)
 
+    @asyncio.coroutine
     def _handle_response(self, resp):
-        if self.callback:
-            yield from self.callback(resp)
+        ctx = self.context
+        if ctx.callback and not ctx.sync_callback:
+            yield from ctx.callback(resp)
             resp.close()
+            self._journal()
+            return
+        body = yield from resp.read()
+        resp.close()
+        if ctx.callback:
+            # Plain callbacks run in the pool. This waits while the pool
+            # is full, which holds back further requests. A response that
+            # is split has no single key to write the result under, so
+            # keyed sinks take it from the result.
+            yield from ctx.callback_pool.submit(ctx.callback, body, self.url, sink=ctx.sink,
+                                                key=None if ctx.split else self.key,
+                                                done=self._journal)
+            return
+        if ctx.split:
+            for key, doc in ctx.split(loads(body)):
+                yield from self._write(dumps(doc), key)
+            self._journal()
+            return
+        if ctx.projection:
+            record = dumps(ctx.projection.project(self.key, loads(body)))
         else:
-            j = yield from resp.json()
-            resp.close()
-            print(json.dumps(j))
+            # Pass the body through as is, rather than decoding and
+            # re-encoding it.
+            record = json_line(body)
+        yield from self._write(record, self.key)
+        self._journal()
 
     @asyncio.coroutine
-    def make_request(self):
-        retries = 0
-        while retries < self.max_retries:
-            try:
-                resp = yield from aiohttp.request(self.method, self.url,
-                                                  **self.request_kwargs)
-                return (yield from self._handle_response(resp))
-            except Exception as exc:
-                retries += 1
-                error = dict(
-                    url=self.url,
-                    params=self.request_kwargs.get('params'),
-                    message='Request failed, retrying.',
-                    retries_left=self.max_retries-retries,
-                )
-                if self.debug:
-                    error['callback'] = repr(self.callback)
-                    error['exception'] = repr(exc)
-                    error['traceback'] = traceback.format_exc()
-                    sys.stderr.write('{}\n'.format(json.dumps(error)))
-            yield from asyncio.sleep(1)
+    def _write(self, record, key):
+        sink = self.context.sink
+        if sink:
+            yield from sink.write(record, key=key)
         else:
-            error['message'] = 'Maximum retries exceeded for url, giving up.'
-            sys.stderr.write('{}\n'.format(json.dumps(error)))
+            print(record.decode('utf-8') if isinstance(record, bytes) else record)
+
+    def _journal(self):
+        """Add the request's key to the journal, once everything written
+        for it has been written out, so that an interrupted run never
+        skips work whose records were lost.
+        """
+        ctx = self.context
+        if (ctx.journal is None) or (not self.key):
             return
+        done = partial(ctx.journal.add, self.key)
+        if ctx.sink:
+            ctx.sink.when_written(done)
+        else:
+            done()
+
+    @asyncio.coroutine
+    def _send(self, request):
+        """Send the request, through the cache if there is one.
+
+        :returns: The response, and whether a request was actually made.
+        """
+        cache = self.context.cache
+        kwargs = self.request_kwargs
+        if not cache:
+            return ((yield from request(self.method, self.url, **kwargs)), True)
+
+        key = cache.key(self.url, kwargs.get('params'))
+        entry = yield from cache.get(key)
+        if entry and cache.is_fresh(entry):
+            yield from cache.hit(key, entry)
+            return (CachedResponse(self.url, entry['body']), False)
+
+        if entry:
+            kwargs = dict(kwargs)
+            kwargs['headers'] = dict(kwargs.get('headers', {}))
+            kwargs['headers'].update(cache.validators(entry))
+        resp = yield from request(self.method, self.url, **kwargs)
+
+        if entry and resp.status == 304:
+            resp.close()
+            yield from cache.revalidate(key, entry)
+            return (CachedResponse(self.url, entry['body']), True)
+        if resp.status == 200:
+            yield from cache.store(key, (yield from resp.read()), resp.headers)
+        return (resp, True)
+
+    def _observe(self, status, latency, exc=None, size=None):
+        observer = self.context.observer
+        if observer:
+            observer(self, status, latency, exc, size)
+
+    def retry_delay(self, base=None, cap=None):
+        """Get the number of seconds to wait before retrying the request.
+
+        The delay grows exponentially with the number of retries, up to
+        ``cap`` seconds, and is picked at random from zero to that value
+        so failed requests don't all retry at once. It is never shorter
+        than the server's ``Retry-After``, if one was given.
+
+        :rtype: float
+        """
+        base = 1.0 if not base else base
+        cap = 60.0 if not cap else cap
+        delay = random.uniform(0, min(cap, base * (2 ** self.retries)))
+        if self.retry_after:
+            delay = max(delay, self.retry_after)
+        return delay
+
+    def _log_error(self, message, exc=None):
+        error = dict(
+            url=self.url,
+            params=self.params,
+            message=message,
+            retries_left=self.max_retries-self.retries,
+        )
+        if self.context.debug:
+            error['callback'] = repr(self.context.callback)
+            error['exception'] = repr(exc)
+            error['traceback'] = traceback.format_exc() if exc else None
+        sys.stderr.write('{}\n'.format(json.dumps(error)))
+
+    @asyncio.coroutine
+    def attempt(self):
+        """Make a single attempt at the request.
+
+        :rtype: bool
+        :returns: ``True`` if the response was handled, ``False`` if the
+                  attempt failed and the request should be retried.
+        """
+        session = self.context.session
+        request = session.request if session else aiohttp.request
+        start = time.monotonic()
+        sent, status, latency = True, None, None
+        self.retry_after = None
+        try:
+            resp, sent = yield from self._send(request)
+            status = resp.status
+            latency = time.monotonic() - start
+            if (status == 429) or (status >= 500):
+                self.retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                resp.close()
+                raise HTTPError('{} response from server.'.format(status))
+            yield from self._handle_response(resp)
+            if sent:
+                self._observe(status, latency, size=response_size(resp))
+            return True
+        except SinkError:
+            # Not the request's fault, so it isn't retried.
+            raise
+        except Exception as exc:
+            if sent:
+                latency = (time.monotonic() - start) if latency is None else latency
+                self._observe(status, latency, exc)
+            self.retries += 1
+            if self.context.debug:
+                self._log_error('Request failed, retrying.', exc)
+            return False
+
+    def give_up(self):
+        self._log_error('Maximum retries exceeded for url, giving up.')
+
+    @asyncio.coroutine
+    def make_request(self):
+        """Make the request, retrying failed attempts after
+        :meth:`retry_delay` seconds.
+
+        :rtype: bool
+        :returns: ``True`` if the response was handled, ``False`` if all
+                  retries failed.
+        """
+        while True:
+            if (yield from self.attempt()):
+                return True
+            if self.retries >= self.max_retries:
+                self.give_up()
+                return False
+            yield from asyncio.sleep(self.retry_delay())
+
+
+# Use the fastest JSON library available where documents need decoding.
+if orjson:
+    loads, dumps = orjson.loads, orjson.dumps
+else:
+    def loads(body):
+        return json.loads(body.decode('utf-8'))
+    dumps = json.dumps
+
+
+def check_json(body):
+    """Strictly check that a body is a single JSON document.
+
+    :raises ValueError: If it isn't.
+    """
+    if orjson:
+        orjson.loads(body)
+    else:
+        strict_json.loads(body.decode('utf-8'))
+
+
+def json_line(body):
+    """Check that a response body is a single JSON document, and put it
+    on one line for JSONL output.
+
+    Bodies without newlines are passed through as they are. Some Metadata
+    API responses have unescaped newlines in strings, so bodies with
+    newlines are decoded and re-encoded, which escapes them.
+
+    :type body: bytes
+
+    :rtype: bytes or str
+    :raises ValueError: If the body isn't a single JSON document.
+    """
+    body = body.strip()
+    if not body:
+        raise ValueError('Empty response body.')
+    if (b'\n' in body) or (b'\r' in body):
+        return dumps(strict_json.loads(body.decode('utf-8'), strict=False))
+    check_json(body)
+    return body
+
+
+def response_size(resp):
+    """Get the size of a response's body in bytes, if it has been read,
+    otherwise from its ``Content-Length`` header.
+
+    :rtype: int
+    """
+    content = getattr(resp, '_content', None)
+    if content is not None:
+        return len(content)
+    length = resp.headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else None
+
+
+def parse_retry_after(value):
+    """Parse a ``Retry-After`` header.
+
+    :rtype: float
+    :returns: The number of seconds to wait, or ``None``.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -0,0 +1,232 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+
+from .requests import loads
+
+
+# Each index entry is a record's key hash, and the offset and length of
+# the record in its shard's data file.
+INDEX_ENTRY = struct.Struct('<QQI')
+MANIFEST = 'manifest.json'
+
+
+def key_hash(key):
+    """Hash a record's key (i.e. its identifier) to pick its shard and
+    look it up in the index.
+
+    :rtype: int
+    """
+    digest = hashlib.sha1(key.encode('utf-8')).digest()[:8]
+    return int.from_bytes(digest, 'little')
+
+
+def data_path(directory, shard):
+    return os.path.join(directory, '{:05d}.jsonl'.format(shard))
+
+
+def index_path(directory, shard):
+    return os.path.join(directory, '{:05d}.idx'.format(shard))
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return json.loads(fh.read())
+
+
+def write_manifest(directory, shards, is_sorted):
+    path = os.path.join(directory, MANIFEST)
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as fh:
+        fh.write(json.dumps(dict(shards=shards, sorted=is_sorted)))
+    os.replace(tmp, path)
+
+
+def sort_index(path):
+    """Sort an index file by key hash, then offset, so that the latest
+    record for a key is the last of its entries. An entry cut short by a
+    crash is dropped.
+    """
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    complete = len(data) - (len(data) % INDEX_ENTRY.size)
+    entries = sorted(INDEX_ENTRY.iter_unpack(data[:complete]))
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'wb') as fh:
+        fh.write(b''.join(INDEX_ENTRY.pack(*e) for e in entries))
+    os.replace(tmp, path)
+
+
+class _Shards(object):
+    """One directory of shards, as written by a single
+    :class:`iamine.sinks.ShardedSink`.
+    """
+
+    def __init__(self, directory, shards):
+        self.directory = directory
+        self.shards = shards
+        self._indexes = dict()
+        self._files = dict()
+
+    def index(self, shard):
+        """Memory-map a shard's index.
+
+        :rtype: :py:class:`mmap.mmap`
+        :returns: The index, or ``None`` if it's empty.
+        """
+        if shard not in self._indexes:
+            m = None
+            with open(index_path(self.directory, shard), 'rb') as fh:
+                if os.fstat(fh.fileno()).st_size:
+                    m = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self._indexes[shard] = m
+        return self._indexes[shard]
+
+    def locate(self, h):
+        shard = h % self.shards
+        index = self.index(shard)
+        if index is None:
+            return None
+        # Find the last entry for the hash, i.e. the latest record.
+        lo, hi = 0, len(index) // INDEX_ENTRY.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if INDEX_ENTRY.unpack_from(index, mid * INDEX_ENTRY.size)[0] <= h:
+                lo = mid + 1
+            else:
+                hi = mid
+        if not lo:
+            return None
+        entry_hash, offset, length = INDEX_ENTRY.unpack_from(index, (lo - 1) * INDEX_ENTRY.size)
+        return (shard, offset, length) if entry_hash == h else None
+
+    def read(self, shard, offset, length):
+        if shard not in self._files:
+            self._files[shard] = open(data_path(self.directory, shard), 'rb')
+        fh = self._files[shard]
+        fh.seek(offset)
+        return fh.read(length)
+
+    def close(self):
+        for m in self._indexes.values():
+            if m is not None:
+                m.close()
+        for fh in self._files.values():
+            fh.close()
+        self._indexes.clear()
+        self._files.clear()
+
+
+class ShardedRecords(object):
+    """Look up records in output written by
+    :class:`iamine.sinks.ShardedSink` (``ia-mine --output DIR --shards N``).
+
+    A record is found by binary search of its shard's memory-mapped
+    index, then read with one seek. When mining with several processes,
+    each writes its own set of shards to a subdirectory of ``directory``,
+    and each set is searched in turn.
+
+    Usage::
+
+        >>> records = ShardedRecords('out')
+        >>> records.get('nasa')['metadata']['title']
+        'NASA Images'
+
+    :param directory: The output directory.
+    :type directory: str
+
+    :raises ValueError: If the output is incomplete, i.e. the run that
+                        wrote it didn't finish. Running it again with the
+                        same output finishes the index.
+    """
+
+    def __init__(self, directory):
+        parts = []
+        if read_manifest(directory):
+            parts.append(directory)
+        else:
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path) and read_manifest(path):
+                    parts.append(path)
+        if not parts:
+            raise ValueError('No sharded output found in {}.'.format(directory))
+
+        self.parts = []
+        for path in parts:
+            manifest = read_manifest(path)
+            if not manifest.get('sorted'):
+                raise ValueError('The index in {} is incomplete.'.format(path))
+            self.parts.append(_Shards(path, manifest['shards']))
+
+    def locate(self, key):
+        """Find a record in the index.
+
+        :rtype: tuple
+        :returns: The path of the data file the record is in, and its
+                  offset and length in bytes, or ``None``.
+        """
+        h = key_hash(key)
+        for part in self.parts:
+            location = part.locate(h)
+            if location:
+                shard, offset, length = location
+                return (data_path(part.directory, shard), offset, length)
+        return None
+
+    def get_raw(self, key):
+        """Read a record, without decoding it.
+
+        :rtype: bytes
+        :returns: The record, or ``None`` if it isn't in the output.
+        """
+        h = key_hash(key)
+        for part in self.parts:
+            location = part.locate(h)
+            if location:
+                return part.read(*location)
+        return None
+
+    def get(self, key):
+        """Read and decode a record.
+
+        :rtype: dict
+        :returns: The record, or ``None`` if it isn't in the output.
+        """
+        record = self.get_raw(key)
+        return None if record is None else loads(record)
+
+    def __contains__(self, key):
+        return self.locate(key) is not None
+
+    def entries(self):
+        """Iterate over every entry of the memory-mapped indexes, sorted
+        by key hash within each shard, for bulk joins against
+        :func:`key_hash` of other keys.
+
+        :rtype: iterable
+        :returns: ``(key_hash, data_path, offset, length)`` tuples.
+        """
+        for part in self.parts:
+            for shard in range(part.shards):
+                index = part.index(shard)
+                if index is None:
+                    continue
+                path = data_path(part.directory, shard)
+                for h, offset, length in INDEX_ENTRY.iter_unpack(index):
+                    yield (h, path, offset, length)
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,579 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import sqlite3
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .exceptions import SinkError
+from .projection import parse_field, get_field
+from .shards import (INDEX_ENTRY, key_hash, data_path, index_path, read_manifest,
+                     write_manifest, sort_index)
+
+
+class Sink(object):
+    """Base class for output sinks.
+
+    Records are buffered and handed to a single writer thread in
+    batches, so writing never blocks the event loop. Only one batch is
+    written at a time. A worker that fills a batch while the previous
+    one is still being written waits for it, which slows mining down to
+    the speed of the output rather than buffering without bound.
+
+    If writing a batch fails, the sink stops: every later write raises
+    :class:`iamine.exceptions.SinkError`, as does :meth:`flush`.
+
+    Subclasses implement :meth:`write_batch`, which runs on the writer
+    thread, and optionally :meth:`close_output`. A batch counts as
+    written once :meth:`write_batch` returns, so it must hand the batch
+    to the OS (or commit it) before returning.
+
+    :param batch_size: (optional) The number of records to buffer before
+                       writing them out. Defaults to 1000.
+    :type batch_size: int
+
+    :param flush_interval: (optional) The maximum number of seconds a
+                           record is buffered for while records are
+                           still being written. Defaults to 1.
+    :type flush_interval: float
+    """
+
+    #: Whether pages of search results are written as one record per
+    #: result, rather than one per page. Sinks that store records by
+    #: identifier need this, as a page has no identifier of its own.
+    split_pages = False
+
+    def __init__(self, batch_size=None, flush_interval=None, loop=None):
+        batch_size = 1000 if not batch_size else batch_size
+        flush_interval = 1.0 if not flush_interval else flush_interval
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.loop = loop
+        self._batch = []
+        self._last_submit = time.monotonic()
+        self._pending = None
+        self._written = []
+        self.error = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @asyncio.coroutine
+    def write(self, record, key=None):
+        """Write a record.
+
+        :param record: A JSON document, without a trailing newline.
+        :type record: str or bytes
+
+        :param key: (optional) The identifier of the item the record
+                    belongs to, if any.
+        :type key: str
+
+        :raises SinkError: If an earlier batch failed to be written.
+        """
+        self.check()
+        self._batch.append((key, record))
+        if (len(self._batch) >= self.batch_size) \
+                or ((time.monotonic() - self._last_submit) >= self.flush_interval):
+            yield from self._submit()
+
+    def check(self):
+        """Raise the error that stopped the sink, if any.
+
+        :raises SinkError:
+        """
+        if self.error is not None:
+            raise self.error
+
+    @asyncio.coroutine
+    def _wait(self):
+        try:
+            yield from self._pending
+        except Exception as exc:
+            self.error = SinkError('Writing records failed: {!r}'.format(exc))
+            raise self.error from exc
+        finally:
+            self._pending = None
+
+    def when_written(self, callback):
+        """Call ``callback`` on the event loop once every record written
+        so far has been written out, e.g. to journal the work they came
+        from. It isn't called if writing them fails.
+        """
+        self._written.append(callback)
+
+    @staticmethod
+    def _call_written(callbacks, future=None):
+        if (future is not None) and (future.cancelled() or future.exception()):
+            return
+        for callback in callbacks:
+            callback()
+
+    @asyncio.coroutine
+    def _submit(self):
+        batch, self._batch = self._batch, []
+        written, self._written = self._written, []
+        self._last_submit = time.monotonic()
+        if self._pending is not None:
+            yield from self._wait()
+        if not batch:
+            # Everything written so far already has been.
+            self._call_written(written)
+            return
+        loop = asyncio.get_event_loop() if not self.loop else self.loop
+        self._pending = loop.run_in_executor(self._executor, self.write_batch, batch)
+        if written:
+            self._pending.add_done_callback(partial(self._call_written, written))
+
+    @asyncio.coroutine
+    def flush(self):
+        """Wait for all buffered records to be written.
+
+        :raises SinkError: If any of them failed to be written.
+        """
+        self.check()
+        if self._batch or self._written:
+            yield from self._submit()
+        if self._pending is not None:
+            yield from self._wait()
+
+    def close(self):
+        """Write out any buffered records and close the output. This
+        blocks until everything has been written.
+        """
+        if self._executor is None:
+            return
+        batch, self._batch = self._batch, []
+        written, self._written = self._written, []
+        future = self._executor.submit(self.write_batch, batch) if batch else None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self.close_output()
+        if (future is not None) and future.exception():
+            # Closing happens on the way out, so this is logged rather
+            # than raised over whatever ended the run.
+            self.error = SinkError('Writing records failed: {!r}'.format(future.exception()))
+            sys.stderr.write('{}\n'.format(json.dumps(dict(
+                message='Writing records failed.',
+                exception=repr(future.exception()),
+            ))))
+        # Earlier batches are only known to be written after a flush.
+        if self._pending is None:
+            self._call_written(written, future)
+
+    def write_batch(self, batch):
+        """Write a batch of ``(key, record)`` tuples. Called on the
+        writer thread.
+        """
+        raise NotImplementedError
+
+    def for_shard(self, shard, lock=None):
+        """Make a new sink like this one, for use by one of several
+        processes mining shards of the same input.
+
+        :param shard: The shard number.
+        :type shard: int
+
+        :param lock: (optional) A :py:class:`multiprocessing.Lock` shared
+                     by all shards, for sinks writing to shared output.
+        """
+        raise NotImplementedError
+
+    def close_output(self):
+        pass
+
+
+def _encode_lines(batch):
+    lines = [r.encode('utf-8') if isinstance(r, str) else r for _, r in batch]
+    lines.append(b'')
+    return b'\n'.join(lines)
+
+
+class StreamSink(Sink):
+    """Write JSONL to a binary stream, stdout by default.
+
+    :param lock: (optional) A lock held while writing each batch, so
+                 that several processes can share one stream without
+                 interleaving records.
+    """
+
+    def __init__(self, stream=None, lock=None, **kwargs):
+        super(StreamSink, self).__init__(**kwargs)
+        self.stream = sys.stdout.buffer if not stream else stream
+        self.lock = lock
+
+    def write_batch(self, batch):
+        data = _encode_lines(batch)
+        if self.lock is None:
+            self.stream.write(data)
+            self.stream.flush()
+            return
+        with self.lock:
+            self.stream.write(data)
+            self.stream.flush()
+
+    def for_shard(self, shard, lock=None):
+        # Streams can't be passed to other processes, so shards always
+        # write to their own stdout (which is inherited from the parent).
+        return StreamSink(lock=lock,
+                          batch_size=self.batch_size,
+                          flush_interval=self.flush_interval)
+
+
+class FileSink(Sink):
+    """Write JSONL to a file, optionally compressed and rotated.
+
+    Compression is chosen from the file extension: ``.gz`` for gzip and
+    ``.zst`` for zstandard (which requires the ``zstandard`` package).
+    When rotating, files are numbered, so ``out.jsonl.gz`` is written as
+    ``out-00000.jsonl.gz``, ``out-00001.jsonl.gz``, and so on. When
+    mining with several processes, each shard writes to its own file,
+    e.g. ``out-s000.jsonl.gz``.
+
+    Records are appended, so a run can be resumed (with ``--journal``)
+    into the same output. Gzip members and zstandard frames can be
+    concatenated, so this works for compressed files too. Rotated files
+    carry on from the one after the highest numbered file that exists.
+
+    :param path: The file to write to.
+    :type path: str
+
+    :param max_bytes: (optional) Start a new file once this many
+                      (uncompressed) bytes have been written.
+    :type max_bytes: int
+
+    :param max_records: (optional) Start a new file once this many
+                        records have been written.
+    :type max_records: int
+    """
+
+    def __init__(self, path, max_bytes=None, max_records=None, **kwargs):
+        super(FileSink, self).__init__(**kwargs)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.rotating = True if (max_bytes or max_records) else False
+        if path.endswith('.zst') and not zstandard:
+            raise ValueError('zstandard must be installed to write .zst files.')
+
+        self._index = self._next_index() if self.rotating else 0
+        self._fh = None
+        self._bytes = 0
+        self._records = 0
+
+    def _next_index(self):
+        dirname, basename = os.path.split(self.path)
+        name, _, ext = basename.partition('.')
+        pattern = re.compile(r'{}-(\d{{5}}){}$'.format(
+            re.escape(name), re.escape('.{}'.format(ext)) if ext else ''))
+        indexes = [int(m.group(1)) for m in
+                   (pattern.match(f) for f in os.listdir(dirname or '.')) if m]
+        return (max(indexes) + 1) if indexes else 0
+
+    def for_shard(self, shard, lock=None):
+        dirname, basename = os.path.split(self.path)
+        name, _, ext = basename.partition('.')
+        name = '{}-s{:03d}'.format(name, shard)
+        path = os.path.join(dirname, '.'.join(x for x in (name, ext) if x))
+        return FileSink(path,
+                        max_bytes=self.max_bytes,
+                        max_records=self.max_records,
+                        batch_size=self.batch_size,
+                        flush_interval=self.flush_interval)
+
+    def _filename(self):
+        if not self.rotating:
+            return self.path
+        dirname, basename = os.path.split(self.path)
+        name, _, ext = basename.partition('.')
+        name = '{}-{:05d}'.format(name, self._index)
+        return os.path.join(dirname, '.'.join(x for x in (name, ext) if x))
+
+    def _open(self):
+        path = self._filename()
+        if path.endswith('.gz'):
+            return gzip.open(path, 'ab', compresslevel=6)
+        elif path.endswith('.zst'):
+            return zstandard.ZstdCompressor().stream_writer(open(path, 'ab'))
+        return open(path, 'ab')
+
+    def _rotate(self):
+        self.close_output()
+        self._index += 1
+        self._bytes = 0
+        self._records = 0
+
+    def write_batch(self, batch):
+        while batch:
+            if self._fh is None:
+                self._fh = self._open()
+            n = len(batch)
+            if self.max_records:
+                n = min(n, self.max_records - self._records)
+            data = _encode_lines(batch[:n])
+            batch = batch[n:]
+            self._fh.write(data)
+            self._fh.flush()
+            self._bytes += len(data)
+            self._records += n
+            if (self.max_records and self._records >= self.max_records) \
+                    or (self.max_bytes and self._bytes >= self.max_bytes):
+                self._rotate()
+
+    def close_output(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class QueueSink(Sink):
+    """Put records on a bounded :py:class:`asyncio.Queue`, to be read by
+    :class:`iamine.records.Records`. Workers wait while the queue is
+    full, so mining goes no faster than the records are consumed. Pages
+    of search results are put on the queue one result at a time.
+
+    :param maxsize: (optional) The number of records to buffer. Defaults
+                    to 1000.
+    :type maxsize: int
+    """
+
+    split_pages = True
+
+    def __init__(self, maxsize=None, **kwargs):
+        super(QueueSink, self).__init__(**kwargs)
+        maxsize = 1000 if not maxsize else maxsize
+        loop = asyncio.get_event_loop() if not self.loop else self.loop
+        self.queue = asyncio.Queue(maxsize, loop=loop)
+
+    @asyncio.coroutine
+    def write(self, record, key=None):
+        yield from self.queue.put(record)
+
+    def when_written(self, callback):
+        # Records are handed over as soon as they're on the queue.
+        callback()
+
+    @asyncio.coroutine
+    def flush(self):
+        pass
+
+
+class ShardedSink(Sink):
+    """Write JSONL to ``shards`` files in a directory, picking each
+    record's file by the hash of its key (its item's identifier). Each
+    shard has an index of where its records are, so single records can
+    be read without scanning the output, with
+    :class:`iamine.shards.ShardedRecords`.
+
+    Records are appended, so a run can be resumed into the same
+    directory. The indexes are sorted when the sink is closed. Pages of
+    search results are written as one record per result.
+
+    :param directory: The directory to write to. It is created if it
+                      does not exist.
+    :type directory: str
+
+    :param shards: (optional) The number of shards. Defaults to 16, and
+                   must match existing output in ``directory``.
+    :type shards: int
+    """
+
+    split_pages = True
+
+    def __init__(self, directory, shards=None, **kwargs):
+        super(ShardedSink, self).__init__(**kwargs)
+        shards = 16 if not shards else shards
+        manifest = read_manifest(directory) if os.path.isdir(directory) else None
+        if manifest and (manifest['shards'] != shards):
+            raise ValueError('{} has {} shards, not {}.'.format(
+                directory, manifest['shards'], shards))
+
+        self.directory = directory
+        self.shards = shards
+        # Nothing is written until the first record is, so that sinks
+        # only used to make others with for_shard() leave no output.
+        self._started = False
+        self._data = dict()
+        self._index = dict()
+        self._offsets = dict()
+
+    def for_shard(self, shard, lock=None):
+        return ShardedSink(os.path.join(self.directory, 's{:03d}'.format(shard)),
+                           shards=self.shards,
+                           batch_size=self.batch_size,
+                           flush_interval=self.flush_interval)
+
+    def _start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Lookups aren't possible until the indexes are sorted again.
+        write_manifest(self.directory, self.shards, False)
+        self._started = True
+
+    def _open(self, shard):
+        self._data[shard] = open(data_path(self.directory, shard), 'ab')
+        self._index[shard] = open(index_path(self.directory, shard), 'ab')
+        self._offsets[shard] = self._data[shard].tell()
+
+    def write_batch(self, batch):
+        if not self._started:
+            self._start()
+        lines = dict()
+        entries = dict()
+        for key, record in batch:
+            record = record.encode('utf-8') if isinstance(record, str) else record
+            # Records without a key can't be looked up, so they all go
+            # in the first shard, unindexed.
+            h = key_hash(key) if key else None
+            shard = 0 if h is None else (h % self.shards)
+            if shard not in self._data:
+                self._open(shard)
+            offset = self._offsets[shard]
+            lines.setdefault(shard, []).append(record)
+            if h is not None:
+                entries.setdefault(shard, []).append(INDEX_ENTRY.pack(h, offset, len(record)))
+            self._offsets[shard] = offset + len(record) + 1
+        for shard, records in lines.items():
+            records.append(b'')
+            self._data[shard].write(b'\n'.join(records))
+            # Data is flushed before the index entries pointing at it.
+            self._data[shard].flush()
+            self._index[shard].write(b''.join(entries.get(shard, [])))
+            self._index[shard].flush()
+
+    def close_output(self):
+        if not self._started:
+            return
+        for fh in list(self._data.values()) + list(self._index.values()):
+            fh.close()
+        self._data.clear()
+        self._index.clear()
+        for shard in range(self.shards):
+            path = index_path(self.directory, shard)
+            if not os.path.exists(path):
+                # Make every shard's files, so lookups needn't check.
+                open(path, 'ab').close()
+                open(data_path(self.directory, shard), 'ab').close()
+            sort_index(path)
+        write_manifest(self.directory, self.shards, True)
+        self._started = False
+
+
+def column_name(field):
+    """Get the SQLite column name for a dotted field, e.g.
+    ``metadata_title`` for ``metadata.title``.
+
+    :rtype: str
+    """
+    return re.sub(r'\W+', '_', field).strip('_')
+
+
+class SQLiteSink(Sink):
+    """Write records to a SQLite database, keyed by identifier.
+
+    Records are upserted, so running the same job again updates records
+    rather than duplicating them. Each batch is written in one
+    transaction, with the database in WAL mode so it can be read while
+    mining.
+
+    The ``items`` table has an ``identifier`` primary key and the JSON
+    ``record``, which can be queried with SQLite's JSON functions. Fields
+    given as ``columns`` are also stored in indexed columns of their
+    own. Values that aren't strings or numbers, such as lists selected
+    by ``files[].name``, are stored as JSON. Pages of search results are
+    stored as one row per result.
+
+    :param path: The database file. It is created if it does not exist.
+    :type path: str
+
+    :param columns: (optional) Dotted paths of fields to store in indexed
+                    columns, as with :class:`iamine.projection.Projection`.
+    :type columns: list
+
+    :param lock: (optional) A lock held while writing each batch, for
+                 several processes writing to the same database.
+    """
+
+    table = 'items'
+    split_pages = True
+
+    def __init__(self, path, columns=None, lock=None, **kwargs):
+        kwargs['batch_size'] = 10000 if not kwargs.get('batch_size') else kwargs['batch_size']
+        super(SQLiteSink, self).__init__(**kwargs)
+        self.path = path
+        self.lock = lock
+        self.fields = list(columns) if columns else []
+        self.columns = [column_name(f) for f in self.fields]
+        self._keys = [parse_field(f) for f in self.fields]
+        self._db = None
+        self._insert = 'INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(
+            self.table,
+            ', '.join('"{}"'.format(c) for c in ['identifier', 'record'] + self.columns),
+            ', '.join('?' for _ in range(len(self.columns) + 2)))
+
+    def for_shard(self, shard, lock=None):
+        # Shards share the database, taking turns to write.
+        return SQLiteSink(self.path,
+                          columns=self.fields,
+                          lock=lock,
+                          batch_size=self.batch_size,
+                          flush_interval=self.flush_interval)
+
+    def _connect(self):
+        # Only used by one thread at a time, but opened on the writer
+        # thread and closed on the thread closing the sink.
+        db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        with db:
+            db.execute('CREATE TABLE IF NOT EXISTS {} '
+                       '(identifier TEXT PRIMARY KEY, record TEXT NOT NULL)'.format(self.table))
+            existing = set(r[1] for r in db.execute('PRAGMA table_info({})'.format(self.table)))
+            for column in self.columns:
+                if column not in existing:
+                    db.execute('ALTER TABLE {} ADD COLUMN "{}"'.format(self.table, column))
+                db.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON {0} ("{1}")'.format(
+                    self.table, column))
+        return db
+
+    def _row(self, key, record):
+        record = record.decode('utf-8') if isinstance(record, bytes) else record
+        doc = None
+        if self.columns or not key:
+            doc = json.loads(record)
+        if not key:
+            key = doc.get('identifier') if isinstance(doc, dict) else None
+            if not key:
+                return None
+        row = [key, record]
+        for keys in self._keys:
+            value = get_field(doc, keys)
+            if (value is not None) and not isinstance(value, (str, int, float)):
+                value = json.dumps(value)
+            row.append(value)
+        return row
+
+    def write_batch(self, batch):
+        if self._db is None:
+            self._db = self._connect()
+        # Records without an identifier can't be upserted, and are
+        # dropped.
+        rows = [r for r in (self._row(k, rec) for k, rec in batch) if r]
+        if self.lock is None:
+            with self._db:
+                self._db.executemany(self._insert, rows)
+            return
+        with self.lock:
+            with self._db:
+                self._db.executemany(self._insert, rows)
+
+    def close_output(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
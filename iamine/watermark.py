@@ -0,0 +1,63 @@
+import os
+import json
+
+
+class Watermark(object):
+    """The latest value of a date field seen in search results, kept in
+    a file between runs so a search can be limited to items that have
+    changed since the last run.
+
+    :param path: The file to keep the watermark in.
+    :type path: str
+
+    :param field: (optional) The date field to track. Defaults to
+                  ``oai_updatedate``.
+    :type field: str
+    """
+
+    def __init__(self, path, field=None):
+        field = 'oai_updatedate' if not field else field
+
+        self.path = path
+        self.field = field
+        self.value = self._load()
+        self.latest = self.value
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as fh:
+            j = json.loads(fh.read())
+        # A watermark for another field can't be used.
+        return j.get('value') if j.get('field') == self.field else None
+
+    def restrict(self, query):
+        """Limit a query to items with a ``field`` at or after the
+        watermark. Items changed at exactly the watermark are mined
+        again, rather than risking missing any.
+
+        :rtype: str
+        """
+        query = query if query else 'all:1'
+        if not self.value:
+            return query
+        return '({}) AND {}:[{} TO *]'.format(query, self.field, self.value)
+
+    def observe(self, doc):
+        """Track the latest ``field`` value in a search result."""
+        value = doc.get(self.field)
+        if isinstance(value, list):
+            value = max(value) if value else None
+        # Dates are ISO 8601, so they compare as strings.
+        if value and ((self.latest is None) or (value > self.latest)):
+            self.latest = value
+
+    def save(self):
+        """Write the latest value seen to the watermark file."""
+        if self.latest == self.value:
+            return
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as fh:
+            fh.write(json.dumps(dict(field=self.field, value=self.latest)))
+        os.replace(tmp, self.path)
+        self.value = self.latest
@@ -19,7 +19,7 @@ if sys.version_info <= (3,):
     sys.exit(1)
 
 install_requires = [
-    'aiohttp>=0.13.1,<0.21.0',
+    'aiohttp>=0.18.0,<0.21.0',
     'schema>=0.4.0,<0.6.0',
     'docopt>=0.6.0,<0.7.0',
 ]
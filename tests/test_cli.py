@@ -0,0 +1,48 @@
+"""Smoke tests of ia-mine's argument parsing, with mining stubbed out."""
+import pytest
+
+from iamine import __main__ as cli
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(cli, 'mine_items', lambda *args, **kwargs: calls.append(kwargs))
+    monkeypatch.setattr(cli, 'search',
+                        lambda *args, **kwargs: calls.append(kwargs) or {'numFound': 0})
+    return calls
+
+
+@pytest.fixture
+def itemlist(tmpdir):
+    path = tmpdir.join('itemlist.txt')
+    path.write('nasa\n')
+    return str(path)
+
+
+def test_mine_itemlist(calls, itemlist):
+    cli.main(['ia-mine', itemlist, '--field', 'metadata.title', '--workers', '10'])
+    assert calls[0]['fields'] == ['metadata.title']
+    assert calls[0]['max_tasks'] == 10
+
+
+@pytest.mark.parametrize('argv', [
+    ['--search', 'collection:nasa', '--num-found'],
+    ['--search', 'collection:nasa', '--cursor', '--rows', '100'],
+    ['--all', '--partitions', '4'],
+])
+def test_search(calls, argv):
+    with pytest.raises(SystemExit) as exc:
+        cli.main(['ia-mine'] + argv)
+    assert exc.value.code == 0
+    assert len(calls) == 1
+
+
+def test_watermark(calls, tmpdir):
+    path = str(tmpdir.join('watermark.json'))
+    with pytest.raises(SystemExit) as exc:
+        cli.main(['ia-mine', '--search', 'collection:nasa', '--watermark', path,
+                  '--watermark-field', 'publicdate'])
+    assert exc.value.code == 0
+    assert calls[0]['watermark'].path == path
+    assert calls[0]['watermark'].field == 'publicdate'